@@ -9,10 +9,10 @@
 
 from PyQt5 import QtWidgets
 
-import scipy.io.wavfile
 import numpy as np
-import math, tempfile, os, pathlib, subprocess
-from urllib.parse import unquote
+import math
+
+import pcmstore
 
 FFT_BIN_SIZE=1024
 OVERLAP=0
@@ -21,29 +21,8 @@ BOX_WIDTH=43
 SAMPLES_PER_BOX=7
 SUBJECT_DURATION=120
 RERFERR_DURATION=60
-
-def extract_audio(dir,clip_mrl: str):
-    # print(f"Extract audio from {clip_mrl}.")
-    filepath = unquote(clip_mrl.split("//")[-1])
-    clip_name = str(os.path.getsize(filepath))  + '_' + os.path.basename(filepath)
-    audio_output = ''.join(clip_name.split(".")[:-1]) + "WAV.wav"  # !! CHECK TO SEE IF FILE IS IN UPLOADS DIRECTORY
-    outfile = dir + audio_output
-    of = pathlib.Path(outfile)
-    if of.exists():
-        print(f"Wave file {outfile} existed, do nothing.")
-    else:
-        subprocess.run(["ffmpeg", "-y", "-i", filepath, "-vn", "-ac", "1", "-f", "wav", outfile],stdout = subprocess.DEVNULL,stderr = subprocess.DEVNULL)
-    return outfile
-
-
-# Read file
-# INPUT: Audio file
-# OUTPUT: Sets sample rate of wav file, Returns data read from wav file (numpy array of integers)
-def read_audio(audio_file):
-    rate, data = scipy.io.wavfile.read(audio_file)  # Return the sample rate (in samples/sec) and data from a WAV file
-    # print(rate)
-    return data, rate
-
+# Search +- this around the offset estimated from the time codes of the clips.
+TIMECODE_WINDOW_MS=5000
 
 def make_horiz_bins(data, fft_bin_size, overlap, box_height):
     horiz_bins = {}
@@ -130,14 +109,19 @@ def find_freq_pairs(freqs_dict_orig, freqs_dict_sample):
     return time_pairs
 
 
-def find_delay(time_pairs):
+def find_delay(time_pairs, lo=None, hi=None):
+    # The most frequent time delta, only counting the ones within [lo, hi] if given.
     t_diffs = {}
     for i in range(len(time_pairs)):
         delta_t = time_pairs[i][0] - time_pairs[i][1]
+        if (lo != None and delta_t < lo) or (hi != None and delta_t > hi):
+            continue
         if delta_t in t_diffs:
             t_diffs[delta_t] += 1
         else:
             t_diffs[delta_t] = 1
+    if not t_diffs:
+        raise ValueError("No matching landmarks.")
     t_diffs_sorted = sorted(t_diffs.items(), key=lambda x: x[1])
     time_delay = t_diffs_sorted[-1][0]
 
@@ -148,6 +132,11 @@ class AdjustClipPosDialog(QtWidgets.QDialog):
     ALIGN_OVERLAP = 1
     ALIGN_LAST = 2
 
+    ENGINE_LANDMARK = 0
+    ENGINE_XCORR = 1
+    ENGINE_STREAM = 2
+    ENGINE_VIDEO = 3
+
     def __init__(self, clip):
         super().__init__()
 
@@ -233,8 +222,23 @@ class AdjustClipPosDialog(QtWidgets.QDialog):
 
         autoPagelayout.addLayout(alignOptionBtns)
 
+        self.engineBox = QtWidgets.QComboBox()
+        self.engineBox.addItem("Spectral landmarks (first minutes)", self.ENGINE_LANDMARK)
+        self.engineBox.addItem("Cross-correlation (GCC-PHAT, full length, sample accurate)", self.ENGINE_XCORR)
+        self.engineBox.addItem("Spectral landmarks (full length, streaming)", self.ENGINE_STREAM)
+        self.engineBox.addItem("Video (luma, motion and scene cuts, for clips without usable audio)", self.ENGINE_VIDEO)
+        autoPagelayout.addWidget(self.engineBox)
+
+        self.skewCheck = QtWidgets.QCheckBox("Estimate clock skew at several points (cross-correlation)")
+        self.skewCheck.setToolTip("For long recordings of devices with drifting clocks, the playback of the clip is then compensated.")
+        self.skewCheck.setEnabled(False)
+        self.engineBox.currentIndexChanged.connect(lambda i: self.skewCheck.setEnabled(self.engineBox.currentData() == self.ENGINE_XCORR))
+        autoPagelayout.addWidget(self.skewCheck)
+        # Clock skew found with the last reference clip, if estimated.
+        self.skew = None
+
         self.autoAdjPage.setLayout(autoPagelayout)
-        self.adjTabs.addTab(self.autoAdjPage, "Auto Detect (by audio)")
+        self.adjTabs.addTab(self.autoAdjPage, "Auto Detect")
 
 
         self.layout.addWidget(self.adjTabs)
@@ -248,7 +252,9 @@ class AdjustClipPosDialog(QtWidgets.QDialog):
         self.setLayout(self.layout)
 
 
-    def getMS(self) -> int:
+    def getMS(self):
+        # Return (offset in ms, clock skew) to apply to the clip, the skew is None if not estimated.
+        skew = None
         if self.adjTabs.currentWidget() == self.manualAdjPage:
             direction = 1
             if self.direction.currentText() == 'Advance': direction = -1
@@ -256,50 +262,63 @@ class AdjustClipPosDialog(QtWidgets.QDialog):
             print (f'Manually adjusted {self.clip.name} by {offset} ms.')
         elif self.adjTabs.currentWidget() == self.autoAdjPage:
             offset = 0
-            refSPos = 0
+            ref = None
+            self.skew = None
+            # The value represents the offset between subject and reference clips
+            # Negative value means the subject is ahead of reference.
             milliseconds = 0
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                print(f'Temporary directory{tmpdirname} created.')
-
-                # The value represents the offset between subject and reference clips
-                # Negative value means the subject is ahead of reference.
-                milliseconds = 0
-
-                # Process the subject file
-                print(f"Trying to allign {self.clip.name}.")
-                wavFileS = extract_audio(tmpdirname+'/', self.clip.mrl)
-                rawAudioS, rate = read_audio(wavFileS)
-                binsDictS = make_horiz_bins(rawAudioS[:44100*SUBJECT_DURATION], FFT_BIN_SIZE, OVERLAP, BOX_HEIGHT)
-                boxesS = make_vert_bins(binsDictS, BOX_WIDTH)
-                ftDictS = find_bin_max(boxesS, SAMPLES_PER_BOX)
-                
-                # Loop through reference clips in track
-                for c in self.tracksBox.currentData().clips:
-                    if c.ePos < self.clip.sPos:
-                        print(f"{c.name} skipped, no backward matching.")
-                        continue
-                    if self.alignOption.checkedId() == self.ALIGN_OVERLAP and c.sPos > self.clip.ePos:
-                        print(f"Only compairing overlaping clips, stop now.")
-                        break
-                    refSPos = c.sPos
-                    wavFileR = extract_audio(tmpdirname+'/', c.mrl)
-                    rawAudioR, rate = read_audio(wavFileR)
-                    binsDictR = make_horiz_bins(rawAudioR[:44100*RERFERR_DURATION], FFT_BIN_SIZE, OVERLAP, BOX_HEIGHT)
-                    boxesR = make_vert_bins(binsDictR, BOX_WIDTH)
-                    ftDictR = find_bin_max(boxesR, SAMPLES_PER_BOX)
-
-                    # Determie time delay between subject and reference wav file
-                    pairs = find_freq_pairs(ftDictS, ftDictR)
-                    delay = find_delay(pairs)
-                    samples_per_sec = float(rate) / float(FFT_BIN_SIZE)
-                    milliseconds = int(round(float(delay) / float(samples_per_sec), 4) * 1000)
-                    print(f"Found diff {milliseconds}ms with {c.name}.")
-
-                    if self.alignOption.checkedId() == self.ALIGN_FIRST:
-                        print("Matched first clip, stop now.")
-                        break
-
-            offset = refSPos - self.clip.sPos + milliseconds
+
+            # Process the subject file, the decoded audio is shared through the PCM store.
+            print(f"Trying to allign {self.clip.name}.")
+            engine = self.engineBox.currentData()
+            try:
+                subject = self.prepareSubject(engine)
+            except ValueError as e:
+                msg = QtWidgets.QMessageBox()
+                msg.setIcon(QtWidgets.QMessageBox.Critical)
+                msg.setText(f"{e} The clip is not moved.")
+                msg.setWindowTitle("Auto Detect")
+                msg.setStandardButtons(QtWidgets.QMessageBox.Ok)
+                msg.exec_()
+                return 0, None
+
+            # Loop through reference clips in track
+            for c in self.tracksBox.currentData().clips:
+                if c.ePos < self.clip.sPos:
+                    print(f"{c.name} skipped, no backward matching.")
+                    continue
+                if self.alignOption.checkedId() == self.ALIGN_OVERLAP and c.sPos > self.clip.ePos:
+                    print(f"Only compairing overlaping clips, stop now.")
+                    break
+                window = self.timecodeWindow(c)
+                if window and (window[0] >= c.duration or window[1] <= -self.clip.duration):
+                    print(f"{c.name} skipped, can't overlap by the time codes.")
+                    continue
+                try:
+                    milliseconds = self.measure(engine, subject, c, window)
+                except ValueError as e:
+                    print(f"{c.name} skipped: {e}")
+                    continue
+                ref = c
+                print(f"Found diff {milliseconds}ms with {c.name}.")
+
+                if self.alignOption.checkedId() == self.ALIGN_FIRST:
+                    print("Matched first clip, stop now.")
+                    break
+
+            if ref == None:
+                msg = QtWidgets.QMessageBox()
+                msg.setIcon(QtWidgets.QMessageBox.Warning)
+                msg.setText("No reference clip could be compared, the clip is not moved.")
+                msg.setWindowTitle("Auto Detect")
+                msg.setStandardButtons(QtWidgets.QMessageBox.Ok)
+                msg.exec_()
+                return 0, None
+            # milliseconds is in the media of the reference, which plays stretched by its own skew on the timeline.
+            offset = ref.tracksPos(milliseconds) - self.clip.sPos
+            if self.skew != None:
+                # The subject drifts by self.skew against the reference media, itself drifting by ref.skew.
+                skew = (1 + self.skew) * (1 + ref.skew) - 1
 
         else:
             msg = QtWidgets.QMessageBox()
@@ -308,15 +327,92 @@ class AdjustClipPosDialog(QtWidgets.QDialog):
             msg.setWindowTitle("Error")
             msg.setStandardButtons(QtWidgets.QMessageBox.Ok)
             msg.exec_()
-            return
-        return offset
+            return 0, None
+        return offset, skew
+
+    def timecodeWindow(self, c):
+        # The (lo, hi) range of the offset with the reference clip c from the time codes, None if unknown.
+        if self.clip.startTime == None or c.startTime == None or self.clip.startKind != c.startKind:
+            return None
+        expected = (self.clip.startTime + self.parentTrack.clockOffset) - (c.startTime + c.parent().clockOffset)
+        return (expected - TIMECODE_WINDOW_MS, expected + TIMECODE_WINDOW_MS)
+
+    def prepareSubject(self, engine):
+        # Decode and analyse the subject clip once for all the reference clips.
+        if engine == self.ENGINE_XCORR:
+            import xcorr
+            # Decoded lazily, only the spans the search reads.
+            return pcmstore.view(self.clip.mrl, xcorr.AUDIO_RATE)
+        if engine == self.ENGINE_STREAM:
+            import streamalign
+            rawAudioS, rate = pcmstore.view(self.clip.mrl, 44100)
+            return streamalign.fingerprint(rawAudioS, rate)
+        if engine == self.ENGINE_VIDEO:
+            import videosig
+            return videosig.signature(self.clip.mrl)
+        # Only the first minutes are decoded.
+        rawAudioS, rate = pcmstore.audio(self.clip.mrl, 44100, 0, SUBJECT_DURATION*1000)
+        binsDictS = make_horiz_bins(rawAudioS, FFT_BIN_SIZE, OVERLAP, BOX_HEIGHT)
+        boxesS = make_vert_bins(binsDictS, BOX_WIDTH)
+        return find_bin_max(boxesS, SAMPLES_PER_BOX)
+
+    def measure(self, engine, subject, c, window=None) -> int:
+        # Return the offset in ms between the subject and the reference clip c.
+        # The search is restricted to the window (lo, hi) in ms if given.
+        if engine == self.ENGINE_XCORR:
+            import xcorr
+            rawAudioS, rate = subject
+            # Within a window only the spans of the clips that can overlap in it are decoded.
+            rawAudioR, rate = pcmstore.view(c.mrl, xcorr.AUDIO_RATE)
+            milliseconds, peak = xcorr.find_offset_ms(rawAudioS, rawAudioR, rate, window)
+            print(f"Cross-correlation peak {peak:.3f} with {c.name}.")
+            if self.skewCheck.isChecked():
+                import skew
+                milliseconds, self.skew = skew.estimate(rawAudioS, rawAudioR, rate, int(round(milliseconds * rate / 1000)))
+            return int(round(milliseconds))
+        if engine == self.ENGINE_STREAM:
+            import streamalign
+            # Decoded chunk by chunk as scanned, up to the early stop and only within the window.
+            rawAudioR, rate = pcmstore.view(c.mrl, 44100)
+            frames = None
+            if window: frames = (int(window[0] * rate / 1000 / FFT_BIN_SIZE) - 1, int(window[1] * rate / 1000 / FFT_BIN_SIZE) + 1)
+            delay, votes, scanned = streamalign.stream_delay(subject, rawAudioR, rate, frames)
+            print(f"Best offset has {votes} votes, scanned {scanned:.0f}s of {c.name}.")
+            return streamalign.delay_ms(delay, rate)
+        if engine == self.ENGINE_VIDEO:
+            import videosig
+            milliseconds, peak = videosig.match(subject, videosig.signature(c.mrl), window)
+            print(f"Video signature match peak {peak:.3f} with {c.name}.")
+            return milliseconds
+
+        ftDictS = subject
+        dataR, rate = pcmstore.view(c.mrl, 44100)
+        samples_per_sec = float(rate) / float(FFT_BIN_SIZE)
+        # The first minute of the reference, or the one where the window puts the start of the subject (in whole boxes).
+        boxSamples = FFT_BIN_SIZE * BOX_WIDTH
+        start = int(max(window[0], 0) * rate / 1000) // boxSamples * boxSamples if window else 0
+        startFrame = start // FFT_BIN_SIZE
+        rawAudioR = dataR[start:start + RERFERR_DURATION*rate]
+        binsDictR = make_horiz_bins(rawAudioR, FFT_BIN_SIZE, OVERLAP, BOX_HEIGHT)
+        boxesR = make_vert_bins(binsDictR, BOX_WIDTH)
+        ftDictR = find_bin_max(boxesR, SAMPLES_PER_BOX)
+
+        # Determie time delay between subject and reference wav file
+        pairs = find_freq_pairs(ftDictS, ftDictR)
+        lo = hi = None
+        if window:
+            # In frames of the reference part read.
+            lo = int(window[0] * samples_per_sec / 1000) - 1 - startFrame
+            hi = int(window[1] * samples_per_sec / 1000) + 1 - startFrame
+        delay = find_delay(pairs, lo, hi) + startFrame
+        return int(round(float(delay) / float(samples_per_sec), 4) * 1000)
     
     @staticmethod
     def getMsShift(clip):
         dialog = AdjustClipPosDialog(clip)
         result = dialog.exec()
         if result == QtWidgets.QDialog.Accepted:
-            return dialog.getMS(), result
+            return (*dialog.getMS(), result)
         else:
-            return 0, result
+            return 0, None, result
 
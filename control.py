@@ -0,0 +1,181 @@
+'''
+ Local control and metrics socket, for scripted (soak) test runs.
+
+ A QLocalServer (a Unix socket on Linux) takes one JSON object per line and
+ answers each with one JSON line:
+
+   {"cmd": "load", "file": "session.tracks"}
+   {"cmd": "play"}, {"cmd": "pause"}
+   {"cmd": "seek", "pos": 60000}
+   {"cmd": "marker", "pos": 30000}   (the current position without pos, 0 clears it)
+   {"cmd": "metrics"}
+
+ Replies are {"ok": true, ...} or {"ok": false, "error": "..."}.
+'''
+
+from PyQt5 import QtCore, QtNetwork
+import json, os, time
+
+# A server answering within this time holds the name, otherwise its socket is stale.
+CONNECT_TIMEOUT_MS = 500
+# The event loop latency is measured with a timer of this interval.
+LOOP_PROBE_MS = 100
+
+
+class ControlServer(QtCore.QObject):
+
+    def __init__(self, player, name):
+        super().__init__(player)
+        self.player = player
+        self.tracks = player.tracks
+        self.buffers = {}
+
+        self.server = QtNetwork.QLocalServer(self)
+        if (not self.server.listen(name) and self.server.serverError() == QtNetwork.QAbstractSocket.AddressInUseError
+                and not serverRunning(name)):
+            # The socket left by a crashed session blocks the name, one of a running session is kept.
+            print(f"Removing the stale control socket {name}.")
+            QtNetwork.QLocalServer.removeServer(name)
+            self.server.listen(name)
+        if self.server.isListening():
+            print(f"Control socket listening on {self.server.fullServerName()}.")
+        else:
+            print(f"Can't listen on control socket {name}: {self.server.errorString()}")
+        self.server.newConnection.connect(self.newConnection)
+
+        # Event loop latency: how late the probe timer fires, the max is reset by each metrics query.
+        self.loopLatency = 0
+        self.loopLatencyMax = 0
+        self.probeNS = time.monotonic_ns()
+        self.probeTimer = QtCore.QTimer(self)
+        self.probeTimer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.probeTimer.timeout.connect(self.probe)
+        self.probeTimer.start(LOOP_PROBE_MS)
+
+    def probe(self):
+        now = time.monotonic_ns()
+        self.loopLatency = max(0, (now - self.probeNS) / 1000000 - LOOP_PROBE_MS)
+        self.loopLatencyMax = max(self.loopLatencyMax, self.loopLatency)
+        self.probeNS = now
+
+    def newConnection(self):
+        while self.server.hasPendingConnections():
+            conn = self.server.nextPendingConnection()
+            self.buffers[conn] = b''
+            conn.readyRead.connect(lambda conn=conn: self.readRequests(conn))
+            conn.disconnected.connect(lambda conn=conn: self.closed(conn))
+
+    def closed(self, conn):
+        self.buffers.pop(conn, None)
+        conn.deleteLater()
+
+    def readRequests(self, conn):
+        self.buffers[conn] += bytes(conn.readAll())
+        *lines, self.buffers[conn] = self.buffers[conn].split(b'\n')
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                reply = self.handle(request)
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            conn.write(json.dumps(reply).encode() + b'\n')
+        conn.flush()
+
+    def handle(self, request):
+        cmd = request.get('cmd')
+        tracks = self.tracks
+        if cmd == 'load':
+            if not self.player.loadTracksFile(request['file']):
+                return {'ok': False, 'error': f"Can't load {request['file']}."}
+        elif cmd == 'play':
+            if not tracks.isPlaying and tracks.totalDuration > 0:
+                self.player.playOrPause()
+        elif cmd == 'pause':
+            if tracks.isPlaying:
+                self.player.playOrPause()
+        elif cmd == 'seek':
+            pos = max(0, min(int(request['pos']), tracks.totalDuration))
+            if tracks.isPlaying:
+                tracks.pausePlay()
+                tracks.resumeFrom = pos
+                tracks.resumePlay()
+            else:
+                tracks.resumeFrom = pos
+                tracks.publishClock()
+                tracks.positionSlider.setValue(pos)
+                # Show the frames there, as the slider does.
+                for t in tracks.tracks:
+                    t.scrubTo(pos)
+        elif cmd == 'marker':
+            tracks.marker = int(request['pos']) if request.get('pos') != None else tracks.getCurPos()
+        elif cmd == 'metrics':
+            return dict(ok=True, **self.metrics())
+        else:
+            return {'ok': False, 'error': f"Unknown command {cmd}."}
+        return {'ok': True, 'position': tracks.getCurPos(), 'playing': tracks.isPlaying}
+
+    def metrics(self):
+        tracks = self.tracks
+        pos = tracks.getCurPos()
+        ts = []
+        for t in tracks.tracks:
+            m = {'no': t.no, 'clip': t.curClip.name if t.curClip else None, 'drift': None}
+            if t.worker:
+                # As last reported by the worker, it measures its drift itself.
+                if t.workerState and t.workerState[0] != None and t.workerState[0] < len(t.clips):
+                    m['clip'] = t.clips[t.workerState[0]].name
+                    m['mediaPos'] = t.workerState[1]
+                    m['drift'] = t.workerState[2]
+            elif t.curClip:
+                # ms the frame shown is ahead (+) or behind (-) the master clock.
+                m['mediaPos'] = t.player.position()
+                m['drift'] = t.player.position() - t.curClip.mediaPos(pos)
+                # ms the frame the last seek landed on is behind its target.
+                m['landingError'] = t.landingError
+            m['lateness'] = list(t.transitionLateness)
+            ts.append(m)
+        latencyMax = self.loopLatencyMax
+        self.loopLatencyMax = self.loopLatency
+        return {
+            'position': pos,
+            'playing': tracks.isPlaying,
+            'speed': tracks.pbSpeedF,
+            'duration': tracks.totalDuration,
+            'marker': tracks.marker,
+            'tracks': ts,
+            'decoders': sum(1 for t in tracks.tracks if decoderOpen(t)),
+            'rss': rss(),
+            'loopLatency': round(self.loopLatency, 1),
+            'loopLatencyMax': round(latencyMax, 1),
+        }
+
+    def close(self):
+        self.probeTimer.stop()
+        self.server.close()
+
+
+def serverRunning(name):
+    # If a server answers on the local socket name.
+    socket = QtNetwork.QLocalSocket()
+    socket.connectToServer(name)
+    running = socket.waitForConnected(CONNECT_TIMEOUT_MS)
+    socket.abort()
+    return running
+
+
+def decoderOpen(track):
+    # If the track has a media open in its player, or in the one of its worker.
+    if track.worker:
+        return bool(track.workerState and track.workerState[3])
+    return track.loadedMrl != None
+
+
+def rss():
+    # Resident set size of the process in bytes, None where /proc isn't available.
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
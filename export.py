@@ -0,0 +1,174 @@
+'''
+ Offline export of the tracks to a single grid (side-by-side) video.
+
+ The timeline of Tracks.getTracksList() is cut into independent segments at
+ the clip boundaries (and every SEGMENT_MAX_MS), each segment is rendered by
+ its own ffmpeg filter graph: tracks scaled into a grid, gaps as black and
+ silence, audio mixed with the track volumes. Segments are encoded in
+ parallel and concatenated without re-encoding.
+'''
+
+from PyQt5 import QtCore
+import math, os, subprocess, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import mediacache
+
+EXPORT_WIDTH = 1920
+EXPORT_HEIGHT = 1080
+EXPORT_FPS = 30
+EXPORT_AUDIO_RATE = 48000
+# Longer stretches without clip boundary are still cut, to have work for all cores.
+SEGMENT_MAX_MS = 60000
+
+
+def grid(n):
+    # (columns, rows) of the layout for n tracks.
+    cols = max(1, math.ceil(math.sqrt(n)))
+    return cols, max(1, math.ceil(n / cols))
+
+
+def clip_end(c):
+    # End of the clip on the timeline, its media is played slower or faster by its clock skew.
+    return c['startPosition'] + int(round(c['duration'] * (1 + c.get('skew', 0.0))))
+
+
+def segments(tracks):
+    # Split the timeline into (start, end) ms ranges where no clip starts or ends.
+    bounds = {0}
+    for t in tracks:
+        for c in t['Clips']:
+            bounds.add(c['startPosition'])
+            bounds.add(clip_end(c))
+    bounds = sorted(bounds)
+    segs = []
+    for start, end in zip(bounds, bounds[1:]):
+        while end - start > SEGMENT_MAX_MS:
+            segs.append((start, start + SEGMENT_MAX_MS))
+            start += SEGMENT_MAX_MS
+        segs.append((start, end))
+    return segs
+
+
+def clip_at(track, pos):
+    for c in track['Clips']:
+        if c['startPosition'] <= pos < clip_end(c):
+            return c
+    return None
+
+
+def has_audio(path):
+    out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", path],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    return bool(out.strip())
+
+
+def segment_command(tracks, start, end, outfile, audio, threads):
+    # The ffmpeg command line rendering [start, end) of the tracks to outfile.
+    dur = (end - start) / 1000
+    cols, rows = grid(len(tracks))
+    cw = EXPORT_WIDTH // cols // 2 * 2
+    ch = EXPORT_HEIGHT // rows // 2 * 2
+    inputs = []
+    filters = []
+    for i, t in enumerate(tracks):
+        c = clip_at(t, start)
+        vol = t.get('Volume', 100) / 100
+        if c:
+            path = mediacache.media_path(c['url'])
+            k = len(inputs) // 6
+            # The media time runs 1 + skew times slower than the timeline.
+            rate = 1 + c.get('skew', 0.0)
+            inputs += ["-ss", f"{(start - c['startPosition']) / rate / 1000:.3f}", "-t", f"{dur / rate:.3f}", "-i", path]
+            retime = f"setpts=PTS*{rate:.9f}," if rate != 1 else ""
+            tempo = f"atempo={1 / rate:.9f}," if rate != 1 else ""
+            filters.append(f"[{k}:v]{retime}scale={cw}:{ch}:force_original_aspect_ratio=decrease,pad={cw}:{ch}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+                           f"fps={EXPORT_FPS},format=yuv420p,tpad=stop_mode=add:stop_duration={dur:.3f}[v{i}]")
+            if audio.get(path):
+                filters.append(f"[{k}:a]{tempo}aresample={EXPORT_AUDIO_RATE},aformat=channel_layouts=stereo,volume={vol:.2f},apad[a{i}]")
+            else:
+                filters.append(f"anullsrc=r={EXPORT_AUDIO_RATE}:cl=stereo[a{i}]")
+        else:
+            filters.append(f"color=c=black:s={cw}x{ch}:r={EXPORT_FPS},format=yuv420p[v{i}]")
+            filters.append(f"anullsrc=r={EXPORT_AUDIO_RATE}:cl=stereo[a{i}]")
+    n = len(tracks)
+    if n > 1:
+        layout = '|'.join(f"{(i % cols) * cw}_{(i // cols) * ch}" for i in range(n))
+        filters.append(''.join(f"[v{i}]" for i in range(n)) + f"xstack=inputs={n}:layout={layout}:fill=black[v]")
+        # amix divides by the number of inputs.
+        filters.append(''.join(f"[a{i}]" for i in range(n)) + f"amix=inputs={n}:duration=longest:dropout_transition=0,volume={n}[a]")
+    else:
+        filters.append("[v0]null[v]")
+        filters.append("[a0]anull[a]")
+    return (["ffmpeg", "-y", "-v", "error", "-nostats", "-progress", "pipe:1"] + inputs +
+            ["-filter_complex", ';'.join(filters), "-map", "[v]", "-map", "[a]", "-t", f"{dur:.3f}",
+             "-c:v", "libx264", "-preset", "medium", "-crf", "20", "-g", str(EXPORT_FPS * 2), "-pix_fmt", "yuv420p",
+             "-c:a", "aac", "-b:a", "192k", "-ar", str(EXPORT_AUDIO_RATE), "-threads", str(threads), outfile])
+
+
+def export(tracks, outfile, progress=None, jobs=None):
+    # Export the tracks (as from Tracks.getTracksList()) to outfile.
+    # progress(doneMs, totalMs, speed) is called from worker threads, speed is in times of realtime.
+    tracks = [t for t in tracks if t['Clips']]
+    if not tracks:
+        return 0
+    segs = segments(tracks)
+    totalMs = segs[-1][1]
+    cpus = os.cpu_count() or 1
+    jobs = jobs or max(1, cpus // 2)
+    threads = max(1, cpus // jobs)
+    audio = {}
+    for t in tracks:
+        for c in t['Clips']:
+            path = mediacache.media_path(c['url'])
+            if path not in audio: audio[path] = has_audio(path)
+
+    done = [0] * len(segs)
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def encode(i, segfile):
+        start, end = segs[i]
+        proc = subprocess.Popen(segment_command(tracks, start, end, segfile, audio, threads), stdout=subprocess.PIPE, text=True)
+        for line in proc.stdout:
+            if line.startswith("out_time_us=") and line.strip()[12:].isdigit():
+                with lock:
+                    done[i] = min(int(line.strip()[12:]) // 1000, end - start)
+                    doneMs = sum(done)
+                if progress: progress(doneMs, totalMs, doneMs / 1000 / max(time.monotonic() - started, 0.001))
+        if proc.wait() != 0:
+            raise RuntimeError(f"Encoding of segment {start}-{end} failed.")
+        with lock:
+            done[i] = end - start
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(outfile))) as tmpdirname:
+        segfiles = [os.path.join(tmpdirname, f"{i:05d}.mp4") for i in range(len(segs))]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for f in [executor.submit(encode, i, segfiles[i]) for i in range(len(segs))]:
+                f.result()
+        listfile = os.path.join(tmpdirname, "segments.txt")
+        with open(listfile, 'w') as f:
+            for s in segfiles:
+                f.write("file '" + s.replace("'", "'\\''") + "'\n")
+        subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", listfile, "-c", "copy", "-movflags", "+faststart", outfile], check=True)
+
+    elapsed = time.monotonic() - started
+    print(f"Exported {len(segs)} segments ({totalMs/1000:.1f}s) to {outfile} in {elapsed:.1f}s, {totalMs/1000/elapsed:.2f}x realtime with {jobs} jobs.")
+    if progress: progress(totalMs, totalMs, totalMs / 1000 / elapsed)
+    return elapsed
+
+
+class ExportRunner(QtCore.QObject):
+    # Runs an export in background, for the GUI.
+
+    progressed = QtCore.pyqtSignal(int, int, float)
+    finished = QtCore.pyqtSignal(str, str)
+
+    def start(self, tracks, outfile):
+        def run():
+            try:
+                export(tracks, outfile, lambda d, t, s: self.progressed.emit(d, t, s))
+                self.finished.emit(outfile, '')
+            except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+                self.finished.emit(outfile, str(e))
+        threading.Thread(target=run, name="export", daemon=True).start()
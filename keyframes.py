@@ -0,0 +1,152 @@
+'''
+ Keyframe and frame timestamp index of clips.
+
+ The index is built in background with an ffprobe packet scan of the video
+ stream and cached on disk. Playback uses it to choose how to seek and to
+ know where a seek really lands, the marker alignment snaps to its frames.
+'''
+
+import json, os, subprocess
+from bisect import bisect_right
+
+import mediacache
+
+# A seek target closer than this (in ms) after a keyframe is a cheap one.
+KEYFRAME_SNAP_MS = 100
+# Bumped when the index format or timestamps change, the old cached indexes are then rebuilt.
+INDEX_VERSION = 2
+
+_jobs = mediacache.BackgroundJobs("keyframes")
+_indexes = {}
+_failed = set()
+
+
+class KeyframeIndex:
+
+    SEEK_NONE = 0
+    SEEK_KEYFRAME = 1
+    SEEK_ACCURATE = 2
+
+    def __init__(self, keyframes, frames):
+        # Both are sorted lists of presentation times in ms.
+        self.keyframes = keyframes
+        self.frames = frames
+
+    def keyframeBefore(self, ms):
+        i = bisect_right(self.keyframes, ms) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def frameAt(self, ms):
+        # The frame displayed at the given time.
+        i = bisect_right(self.frames, ms) - 1
+        return self.frames[i] if i >= 0 else 0
+
+    def nearestFrame(self, ms):
+        i = bisect_right(self.frames, ms)
+        candidates = self.frames[max(i-1, 0):i+1]
+        return min(candidates, key=lambda f: abs(f - ms)) if candidates else ms
+
+    def seekPlan(self, ms):
+        # Return (strategy, target, landing) for playing from ms of the clip.
+        if not self.frames or self.frameAt(ms) == self.frames[0]:
+            return KeyframeIndex.SEEK_NONE, 0, self.frames[0] if self.frames else 0
+        # Always seek to the frame itself, landing on the keyframe before would put the track behind the others.
+        landing = self.frameAt(ms)
+        if ms - self.keyframeBefore(ms) <= KEYFRAME_SNAP_MS:
+            # Cheap, the decoder starts right at the keyframe.
+            return KeyframeIndex.SEEK_KEYFRAME, landing, landing
+        # Decoder has to decode from the keyframe up to the frame.
+        return KeyframeIndex.SEEK_ACCURATE, landing, landing
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'keyframes': self.keyframes, 'frames': self.frames}, f)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            d = json.load(f)
+        return KeyframeIndex(d['keyframes'], d['frames'])
+
+
+def start_time(filepath):
+    # Start time (s) of the media, which the player shows as position 0; None if unknown.
+    out = mediacache.run(["ffprobe", "-v", "error", "-show_entries", "format=start_time", "-of", "csv=p=0", filepath],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    try:
+        return float(out)
+    except ValueError:
+        return None
+
+
+def scan_packets(filepath):
+    # ffprobe the packets of the first video stream, return (keyframes, frames) in ms from the start of the media.
+    out = mediacache.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", filepath],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True).stdout
+    keyframes = []
+    frames = []
+    for line in out.splitlines():
+        fields = line.split(',')
+        if len(fields) < 2 or fields[0] in ('', 'N/A'):
+            continue
+        ms = int(round(float(fields[0]) * 1000))
+        frames.append(ms)
+        if 'K' in fields[1]:
+            keyframes.append(ms)
+    # Packets are in decoding order.
+    frames.sort()
+    keyframes.sort()
+    # Timestamps of MPEG-TS (and some other) files don't start at 0, the positions of the player do.
+    start = start_time(filepath)
+    origin = int(round(start * 1000)) if start != None else (frames[0] if frames else 0)
+    return [k - origin for k in keyframes], [f - origin for f in frames]
+
+
+def build_index(mrl, key):
+    try:
+        keyframes, frames = scan_packets(mediacache.media_path(mrl))
+    except (OSError, subprocess.CalledProcessError):
+        # Don't try again for this session.
+        _failed.add(key)
+        raise
+    index = KeyframeIndex(keyframes, frames)
+    index.save(mediacache.cache_path('keyframes', key, f'_v{INDEX_VERSION}.json'))
+    _indexes[key] = index
+    print(f"Indexed {len(keyframes)} keyframes of {len(frames)} frames in {os.path.basename(mediacache.media_path(mrl))}.")
+    return index
+
+
+def get_index(mrl):
+    # Return the index of the clip, or None if it's not available yet (a background build is then requested).
+    try:
+        key = mediacache.source_key(mrl)
+    except OSError:
+        return None
+    if key in _indexes:
+        return _indexes[key]
+    if key in _failed:
+        return None
+    path = mediacache.cache_path('keyframes', key, f'_v{INDEX_VERSION}.json')
+    if os.path.exists(path):
+        try:
+            _indexes[key] = KeyframeIndex.load(path)
+            return _indexes[key]
+        except (OSError, ValueError, KeyError):
+            pass
+    _jobs.submit(key, build_index, mrl, key)
+    return None
+
+
+def shutdown():
+    # Stop the index builds, when the application closes.
+    _jobs.shutdown()
+
+
+def request_index(mrl):
+    get_index(mrl)
+
+
+def keyframe_at(mrl, ms):
+    # The keyframe shown for ms of the clip in trick play, ms itself if the clip isn't indexed yet.
+    index = get_index(mrl)
+    return index.keyframeBefore(ms) if index else ms
@@ -0,0 +1,169 @@
+'''
+ Disk cache for data derived from media files (indexes, proxies, ...) and the
+ background jobs building them.
+
+ Entries are keyed by the source identity of the media: path, size and
+ modification time, so a changed file is never served stale data.
+'''
+
+import os, hashlib, shutil, subprocess, sys, threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+CACHE_DIR = os.environ.get('TRACKSPLAYER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'TracksPlayer'))
+
+# The BackgroundJobs running the job of the current thread, if any.
+_current = threading.local()
+
+
+def media_path(mrl: str):
+    # Local file path of a clip mrl (file:///...) or path.
+    return unquote(mrl.split("//")[-1])
+
+
+def source_key(mrl: str):
+    path = media_path(mrl)
+    st = os.stat(path)
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return f'{digest}_{st.st_size}_{st.st_mtime_ns}'
+
+
+def cache_path(kind, key, suffix=''):
+    # Path of a cache entry, the directory of the kind is created if needed.
+    kindDir = os.path.join(CACHE_DIR, kind)
+    os.makedirs(kindDir, exist_ok=True)
+    return os.path.join(kindDir, key + suffix)
+
+
+def touch(path):
+    # Mark an entry as used, for the LRU eviction.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def entry_size(path):
+    if os.path.isdir(path):
+        return sum(entry_size(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def evict(kind, maxBytes, keep=()):
+    # Remove the least recently used entries of the kind until they fit in maxBytes.
+    kindDir = os.path.join(CACHE_DIR, kind)
+    if not os.path.isdir(kindDir):
+        return 0
+    entries = []
+    for name in os.listdir(kindDir):
+        path = os.path.join(kindDir, name)
+        try:
+            entries.append((os.stat(path).st_mtime, entry_size(path), path))
+        except OSError:
+            continue
+    total = sum(e[1] for e in entries)
+    freed = 0
+    for mtime, size, path in sorted(entries):
+        if total - freed <= maxBytes:
+            break
+        if path in keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        freed += size
+    if freed: print(f"Evicted {freed/1048576:.1f} MB from the {kind} cache.")
+    return freed
+
+
+def popen(args, **kwargs):
+    # subprocess.Popen(), the process is terminated if the BackgroundJobs running the job of this thread is shut down.
+    jobs = getattr(_current, 'jobs', None)
+    if jobs == None:
+        return subprocess.Popen(args, **kwargs)
+    return jobs.popen(args, **kwargs)
+
+
+def run(args, check=False, **kwargs):
+    # subprocess.run() with popen().
+    with popen(args, **kwargs) as proc:
+        try:
+            stdout, stderr = proc.communicate()
+        except:
+            proc.kill()
+            raise
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, stdout, stderr)
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+
+class BackgroundJobs:
+    # A small pool of worker threads, a job is only submitted once per key until it finishes.
+
+    def __init__(self, name, workers=2):
+        self.name = name
+        self.workers = workers
+        self.executor = None
+        self.pending = {}
+        # Processes started by the jobs (with popen()), terminated by shutdown().
+        self.processes = set()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        with self.lock:
+            if self.closed:
+                return None
+            if key in self.pending:
+                return self.pending[key]
+            if self.executor == None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            future = self.executor.submit(self.runJob, fn, *args)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self.done(key, f))
+        return future
+
+    def runJob(self, fn, *args):
+        _current.jobs = self
+        try:
+            return fn(*args)
+        finally:
+            _current.jobs = None
+
+    def done(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+        if not future.cancelled() and future.exception():
+            print(f"{self.name}: job {key} failed: {future.exception()}")
+
+    def isPending(self, key):
+        return key in self.pending
+
+    def popen(self, args, **kwargs):
+        with self.lock:
+            if self.closed:
+                raise OSError(f"{self.name} jobs are shut down.")
+            # Forget the processes that ended.
+            self.processes = {p for p in self.processes if p.poll() == None}
+            proc = subprocess.Popen(args, **kwargs)
+            self.processes.add(proc)
+        return proc
+
+    def shutdown(self):
+        # Drop the queued jobs and terminate the processes of the running ones, when the application closes.
+        with self.lock:
+            self.closed = True
+            executor, self.executor = self.executor, None
+            futures = list(self.pending.values())
+            processes = list(self.processes)
+        if executor != None:
+            if sys.version_info >= (3, 9):
+                executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+        for proc in processes:
+            if proc.poll() == None:
+                proc.terminate()
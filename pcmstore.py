@@ -0,0 +1,230 @@
+'''
+ Decoded audio store shared by the analysis workers.
+
+ The audio of a clip is kept as mono 16 bits PCM at a given sample rate in a
+ raw file of the media cache (keyed by the source identity and the rate),
+ read zero-copy with np.memmap by any thread or process. Only the spans
+ asked for (or sliced from an AudioView) are decoded, by ffmpeg in
+ PCM_CHUNK_SECONDS chunks; the decoded ranges are recorded in a sidecar JSON
+ updated under a file lock. The store is bounded in size with LRU eviction
+ of whole clips.
+'''
+
+import json, os, subprocess
+
+import numpy as np
+
+import mediacache
+
+try:
+    import fcntl
+except ImportError:
+    # No file locking (Windows), the store is then only safe within a process.
+    fcntl = None
+
+PCM_CACHE_MB = 4096
+# Spans are decoded in whole chunks of this length, so near requests share them.
+PCM_CHUNK_SECONDS = 60
+# Bytes read from ffmpeg at a time.
+PCM_READ_BYTES = 1 << 20
+
+SAMPLES_FILE = 'samples.s16'
+RANGES_FILE = 'ranges.json'
+LOCK_FILE = 'lock'
+
+
+def probe_duration(filepath):
+    # Duration of the media in seconds, 0 if unknown.
+    out = mediacache.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", filepath],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    try:
+        return float(out)
+    except ValueError:
+        return 0.0
+
+
+def has_audio(filepath):
+    out = mediacache.run(["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", filepath],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    return bool(out.strip())
+
+
+def missing(ranges, start, end):
+    # The parts of [start, end) not covered by the sorted ranges.
+    gaps = []
+    for s, e in ranges:
+        if e <= start:
+            continue
+        if s >= end:
+            break
+        if s > start:
+            gaps.append((start, s))
+        start = max(start, e)
+    if start < end:
+        gaps.append((start, end))
+    return gaps
+
+
+def merged(ranges, start, end):
+    ranges = sorted(ranges + [[start, end]])
+    out = [ranges[0]]
+    for s, e in ranges[1:]:
+        if s <= out[-1][1]:
+            out[-1][1] = max(out[-1][1], e)
+        else:
+            out.append([s, e])
+    return out
+
+
+class _Lock:
+    # Exclusive lock of an entry across threads and processes.
+
+    def __init__(self, entry):
+        self.path = os.path.join(entry, LOCK_FILE)
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl: fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl: fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def decode(filepath, samplesPath, rate, start, end=None):
+    # Decode the samples [start, end) of the media into the samples file, up to the end of the media if end is None.
+    # Return (samples written, failed), failed if ffmpeg stopped with an error before the end of the span.
+    count = (end - start) * 2 if end != None else float('inf')
+    span = ["-t", f"{(end - start) / rate + 1:.6f}"] if end != None else []
+    proc = mediacache.popen(["ffmpeg", "-v", "error", "-ss", f"{start / rate:.6f}", "-i", filepath] + span +
+                            ["-vn", "-ac", "1", "-ar", str(rate), "-f", "s16le", "-"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    written = 0
+    ended = False
+    with open(samplesPath, 'r+b') as f:
+        f.seek(start * 2)
+        while count > 0:
+            buf = proc.stdout.read(min(PCM_READ_BYTES, count))
+            if not buf:
+                ended = True
+                break
+            # Whole samples only.
+            buf = buf[:len(buf) // 2 * 2]
+            f.write(buf)
+            written += len(buf)
+            count -= len(buf)
+    proc.stdout.close()
+    if ended:
+        failed = proc.wait() != 0
+    else:
+        proc.kill()
+        proc.wait()
+        failed = False
+    return written // 2, failed
+
+
+def entry_for(mrl, rate):
+    # The store entry of the clip at rate, created (empty) if needed: (directory, total samples).
+    entry = mediacache.cache_path('pcm', mediacache.source_key(mrl), f'_{rate}')
+    os.makedirs(entry, exist_ok=True)
+    with _Lock(entry):
+        rangesPath = os.path.join(entry, RANGES_FILE)
+        if os.path.exists(rangesPath):
+            with open(rangesPath) as f:
+                total = json.load(f)['samples']
+        else:
+            if not has_audio(mediacache.media_path(mrl)):
+                raise ValueError(f"{os.path.basename(mediacache.media_path(mrl))} has no audio.")
+            samplesPath = os.path.join(entry, SAMPLES_FILE)
+            total = int(probe_duration(mediacache.media_path(mrl)) * rate)
+            # A sparse file, the spans are filled in as they're decoded.
+            with open(samplesPath, 'wb') as f:
+                f.truncate(total * 2)
+            ranges = []
+            if total == 0:
+                # Unknown duration (a file still being written, a stream): decode all there is.
+                print(f"Decoding all the audio of {os.path.basename(mediacache.media_path(mrl))} at {rate} Hz.")
+                total, failed = decode(mediacache.media_path(mrl), samplesPath, rate, 0)
+                if failed or total == 0:
+                    # Not recorded, so it's tried again.
+                    os.remove(samplesPath)
+                    raise ValueError(f"No audio could be decoded from {os.path.basename(mediacache.media_path(mrl))}.")
+                ranges = [[0, total]]
+            write_ranges(entry, {'rate': rate, 'samples': total, 'ranges': ranges})
+            mediacache.evict('pcm', PCM_CACHE_MB * 1048576, keep=(entry,))
+    return entry, total
+
+
+def write_ranges(entry, info):
+    path = os.path.join(entry, RANGES_FILE)
+    with open(path + '.part', 'w') as f:
+        json.dump(info, f)
+    os.replace(path + '.part', path)
+
+
+def ensure(mrl, entry, rate, start, end):
+    # Decode what's missing of the samples [start, end), in whole chunks.
+    chunk = PCM_CHUNK_SECONDS * rate
+    with _Lock(entry):
+        with open(os.path.join(entry, RANGES_FILE)) as f:
+            info = json.load(f)
+        start = start // chunk * chunk
+        end = min(-(-end // chunk) * chunk, info['samples'])
+        gaps = missing(info['ranges'], start, end)
+        name = os.path.basename(mediacache.media_path(mrl))
+        try:
+            for s, e in gaps:
+                print(f"Decoding {(e - s) / rate:.0f}s of audio of {name} at {rate} Hz.")
+                written, failed = decode(mediacache.media_path(mrl), os.path.join(entry, SAMPLES_FILE), rate, s, e)
+                if failed or (written == 0 and s == 0):
+                    # Only what's really decoded is recorded, the rest is tried again next time.
+                    if written: info['ranges'] = merged(info['ranges'], s, s + written)
+                    raise ValueError(f"Decoding the audio of {name} failed at {s / rate:.0f}s.")
+                # Fewer samples without error is the audio ending before the container, the rest is silence.
+                info['ranges'] = merged(info['ranges'], s, e)
+        finally:
+            if gaps:
+                write_ranges(entry, info)
+
+
+class AudioView:
+    # The audio of a clip as a lazy sequence of samples: slicing it decodes only that span (if not decoded yet),
+    # so the aligners read the windows and chunks they need with no full decode up front.
+
+    def __init__(self, mrl, rate):
+        self.mrl = mrl
+        self.rate = rate
+        self.entry, self.total = entry_for(mrl, rate)
+        if self.total == 0:
+            raise ValueError(f"No audio could be decoded from {os.path.basename(mediacache.media_path(mrl))}.")
+        self.data = None
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, key):
+        # A read only np.memmap of int16, raise ValueError if the span can't be decoded.
+        if not isinstance(key, slice):
+            raise TypeError("AudioView only supports slices.")
+        start, end, step = key.indices(self.total)
+        if end <= start:
+            return np.zeros(0, dtype=np.int16)
+        mediacache.touch(self.entry)
+        ensure(self.mrl, self.entry, self.rate, start, end)
+        if self.data is None:
+            self.data = np.memmap(os.path.join(self.entry, SAMPLES_FILE), dtype=np.int16, mode='r', shape=(self.total,))
+        return self.data[start:end:step]
+
+
+def view(mrl, rate):
+    # Return (AudioView, rate) of the clip, raise ValueError if it has no audio.
+    return AudioView(mrl, rate), rate
+
+
+def audio(mrl, rate, startMs=0, endMs=None):
+    # Return (samples, rate) of the clip from startMs to endMs (the end if None), a read only np.memmap of int16.
+    # Raise ValueError if the clip has no audio.
+    data = AudioView(mrl, rate)
+    start = min(int(startMs * rate / 1000), len(data))
+    end = len(data) if endMs == None else min(int(endMs * rate / 1000), len(data))
+    return data[start:end], rate
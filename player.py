@@ -1,26 +1,40 @@
 import sys
 
+import startup
+if '--startup-report' in sys.argv: startup.install_import_timer()
+
 from PyQt5 import QtWidgets, QtGui, QtCore
-import os, time, datetime, operator
-import yaml
+import os, time, datetime, operator, argparse
 
 from tracks import *
+import keyframes, timecode
+from export import ExportRunner
+from watchfolder import WatchFolder
+
+# Default name of the --control socket.
+CONTROL_NAME = "TracksPlayer"
 
 class Player(QtWidgets.QMainWindow):
     """A simple player for video tracks using VLC and Qt
     """
         
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, processPerTrack=False):
         super().__init__(parent)
         self.setWindowTitle("Tracks Player")
         # self.setWindowFlags(QtCore.Qt.FramelessWindowHint)
 
         self.widget = QtWidgets.QWidget(self)
                 
-        self.tracks = Tracks(self)
+        self.tracks = Tracks(self, processPerTrack)
 
         self.tracks.workingDirectory = os.getcwd()
 
+        # New recordings in the watched folders are added to their tracks.
+        self.watchFolder = WatchFolder(self.tracks)
+
+        # The local control socket, started by main() on request.
+        self.control = None
+
         self.createUI()
 
         self.timer = QtCore.QTimer()
@@ -39,6 +53,9 @@ class Player(QtWidgets.QMainWindow):
 
         self.loopCheck = QtWidgets.QCheckBox("Loop", self)
 
+        self.proxyCheck = QtWidgets.QCheckBox("Proxy", self)
+        self.proxyCheck.setToolTip("Play low resolution proxies of the clips (built in background) instead of the originals.")
+
         markerLabel = QtWidgets.QLabel("↘️︎:", self)
         self.markerPos = QtWidgets.QLabel(self)
         self.markerPos.setToolTip("In player window, use Ctrl + mouse click to set marker, Shift + mouse click to sync to marker, and Alt + mouse click to clear the marker.")
@@ -54,6 +71,20 @@ class Player(QtWidgets.QMainWindow):
         self.saveTracksBtn.setFixedSize(50, 30)
         self.saveTracksBtn.setToolTip("Save the track(s) to a file.")
 
+        self.exportBtn = QtWidgets.QPushButton("🎞︎", self)
+        self.exportBtn.setCheckable(False)
+        self.exportBtn.setFixedSize(50, 30)
+        self.exportBtn.setToolTip("Export the track(s) to a single grid video.")
+
+        self.exporter = ExportRunner(self)
+        self.exporter.progressed.connect(self.exportProgressed)
+        self.exporter.finished.connect(self.exportFinished)
+
+        self.watchBtn = QtWidgets.QPushButton("👁︎", self)
+        self.watchBtn.setCheckable(False)
+        self.watchBtn.setFixedSize(50, 30)
+        self.watchBtn.setToolTip("Watch a folder and add the new recordings in it to a track.")
+
         self.newTracksBtn = QtWidgets.QPushButton("🗋", self)
         self.newTracksBtn.setCheckable(False)
         self.newTracksBtn.setFixedSize(50, 30)
@@ -61,10 +92,9 @@ class Player(QtWidgets.QMainWindow):
 
         self.speedDial = QtWidgets.QDial(self)
         self.speedDial.setMinimum(0)
-        self.speedDial.setMaximum(2)
-        self.speedDial.setValue(self.tracks.pbSpeedF)
-        self.speedDial.setDisabled(True)
-        self.speedDial.setToolTip("Playback speed dial (unimplemented.).")
+        self.speedDial.setMaximum(len(Tracks.SPEEDS) - 1)
+        self.speedDial.setValue(Tracks.SPEEDS.index(self.tracks.pbSpeedF))
+        self.speedDial.setToolTip("Playback speed dial: " + ", ".join(f"{s}x" for s in Tracks.SPEEDS) + ", the high speeds show keyframes only (of the proxies if ready).")
 
         self.sttBar= QtWidgets.QStatusBar(self)
         # self.sttBar.addPermanentWidget(self.progressClock)
@@ -77,12 +107,15 @@ class Player(QtWidgets.QMainWindow):
         controlsBox.addWidget(self.ppBtn)
         controlsBox.addWidget(self.progressClock)
         controlsBox.addWidget(self.loopCheck)
+        controlsBox.addWidget(self.proxyCheck)
         controlsBox.addSpacing(20)
         controlsBox.addWidget(markerLabel)
         controlsBox.addWidget(self.markerPos)
         controlsBox.addStretch()
         controlsBox.addWidget(self.addTrackBtn)
         controlsBox.addWidget(self.saveTracksBtn)
+        controlsBox.addWidget(self.exportBtn)
+        controlsBox.addWidget(self.watchBtn)
         controlsBox.addWidget(self.speedDial)
         controlsBox.addWidget(self.newTracksBtn)
         
@@ -98,7 +131,11 @@ class Player(QtWidgets.QMainWindow):
 
         self.saveTracksBtn.clicked.connect(self.saveTracksToYaml)
         self.newTracksBtn.clicked.connect(self.newTracks)
+        self.exportBtn.clicked.connect(self.exportTracks)
+        self.watchBtn.clicked.connect(self.watchFolderOfTrack)
 
+        self.proxyCheck.toggled.connect(self.tracks.setUseProxies)
+        self.speedDial.valueChanged.connect(lambda v: self.tracks.setSpeed(Tracks.SPEEDS[v]))
         self.ppBtn.clicked.connect(self.playOrPause)
         self.addTrackBtn.clicked.connect(self.tracks.addTrack)
 
@@ -134,7 +171,8 @@ class Player(QtWidgets.QMainWindow):
                 else:
                     self.stopAll()
             posS = int(pos/1000)
-            self.tracks.positionSlider.setValue(posS)
+            if not self.tracks.positionSlider.isSliderDown():
+                self.tracks.positionSlider.setValue(pos)
             self.progressClock.setText(str(datetime.timedelta(seconds=posS)) + "/" + str(datetime.timedelta(seconds=int(self.tracks.totalDuration/1000))))
             self.ppBtn.setText("⏸︎")
         else:
@@ -143,16 +181,49 @@ class Player(QtWidgets.QMainWindow):
         self.markerPos.setText(str(datetime.timedelta(seconds=self.tracks.marker/1000)))
             
     def saveTracksToYaml(self):
+        import yaml
         fname = QtWidgets.QFileDialog.getSaveFileName(self, caption='Save Track(s)', filter="Tracks Files (*.tracks)")
         tFile = {'Version': 1, 'Timestamp': int(time.time())}
         tracks = self.tracks.getTracksList()
         tFile['Tracks']=tracks
+        tFile['TimeOrigin'] = self.tracks.timeOrigin
+        tFile['TimeOriginKind'] = self.tracks.timeOriginKind
         file = open(fname[0],'w')
         file.write(yaml.dump(tFile))
         file.close()
         self.sttBar.showMessage(f'Tracks info saved to {fname[0]}.')
 
+    def exportTracks(self):
+        fname = QtWidgets.QFileDialog.getSaveFileName(self, caption='Export Track(s)', filter="Video Files (*.mp4)")
+        if not fname[0]:
+            return
+        self.exportBtn.setDisabled(True)
+        self.exporter.start(self.tracks.getTracksList(), fname[0])
+        self.sttBar.showMessage(f'Exporting to {fname[0]}...')
+
+    def exportProgressed(self, doneMs, totalMs, speed):
+        self.sttBar.showMessage(f'Exporting: {str(datetime.timedelta(seconds=int(doneMs/1000)))}/{str(datetime.timedelta(seconds=int(totalMs/1000)))} ({100*doneMs/max(totalMs,1):.0f}%), {speed:.2f}x realtime.')
+
+    def exportFinished(self, fname, error):
+        self.exportBtn.setDisabled(False)
+        if error:
+            self.sttBar.showMessage(f'Export to {fname} failed: {error}')
+        else:
+            self.sttBar.showMessage(f'Exported to {fname}.')
+
+    def watchFolderOfTrack(self):
+        if not self.tracks.tracks:
+            self.tracks.addTrack()
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, "Folder to watch", self.tracks.workingDirectory)
+        if not directory:
+            return
+        items = [f"Track {t.no}" for t in self.tracks.tracks]
+        item, ok = QtWidgets.QInputDialog.getItem(self, "Watch folder", f"Add the new recordings of {directory} to:", items, 0, False)
+        if ok:
+            self.watchFolder.watch(directory, self.tracks.tracks[items.index(item)])
+
     def newTracks(self):
+        self.watchFolder.unwatch()
         self.tracks.closeAllTracks()
         self.tracks.addTrack()
 
@@ -162,25 +233,65 @@ class Player(QtWidgets.QMainWindow):
             event.accept()
 
     def dropEvent(self, event):
-        fname = event.mimeData().urls()[0].toLocalFile()
-        file = open(fname, 'r')
+        self.loadTracksFile(event.mimeData().urls()[0].toLocalFile())
+
+    def loadTracksFile(self, fname):
+        # Load a .tracks file, return False if it can't be.
+        import yaml
+        try:
+            file = open(fname, 'r')
+        except OSError:
+            self.statusBar().showMessage(f"Can't open {fname}.")
+            return False
         try:
             tFile = yaml.safe_load(file)
         except:
             file.close()
             self.statusBar().showMessage('Error parsing .tracks File.')
-            return
+            return False
         file.close()
         # print(type(tracks))
+        self.watchFolder.unwatch()
         self.tracks.loadTracks(tFile['Tracks'])
+        self.tracks.timeOrigin = tFile.get('TimeOrigin')
+        # Files saved before the kinds were recorded, the origin is only used with epoch times if it is one.
+        self.tracks.timeOriginKind = tFile.get('TimeOriginKind', timecode.EPOCH if (tFile.get('TimeOrigin') or 0) > 86400000 else timecode.TIME_OF_DAY)
         self.refreshUI()
+        return True
     
     def closeEvent(self, event):
+        if self.control: self.control.close()
+        # Queued cache builds are dropped and the running ffmpeg stopped, not to outlive the window.
+        for jobs in (self.tracks.proxies.jobs, self.tracks.thumbnails.jobs, self.tracks.waveforms.jobs, self.watchFolder.jobs):
+            jobs.shutdown()
+        keyframes.shutdown()
         self.tracks.closeAllTracks()
+        if self.tracks.processPerTrack: self.tracks.clock.close()
         return super().closeEvent(event)
 
 
+def watch_arg(value):
+    # Parse a --watch DIR=TRACK value to (directory, track number).
+    directory, _, trackNo = value.rpartition('=')
+    if not directory or not trackNo.isdigit() or int(trackNo) < 1:
+        raise argparse.ArgumentTypeError(f"expected DIR=TRACK with a track number from 1, got '{value}'")
+    if not os.path.isdir(directory):
+        raise argparse.ArgumentTypeError(f"'{directory}' is not a directory")
+    return directory, int(trackNo)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="A simple multi-tracks video player.")
+    parser.add_argument('--startup-report', action='store_true', help="print time to first window with an import time breakdown.")
+    parser.add_argument('--process-per-track', action='store_true', help="play each track in its own process.")
+    parser.add_argument('--watch', action='append', default=[], type=watch_arg, metavar='DIR=TRACK', help="add the new recordings in DIR to track number TRACK.")
+    parser.add_argument('--control', nargs='?', const=CONTROL_NAME, metavar='NAME', help=f"accept commands and metrics queries on a local socket (default {CONTROL_NAME}).")
+    parser.add_argument('--no-warm-up', action='store_true', help="don't preload the heavy modules in background.")
+    args = parser.parse_args()
+    if args.process_per_track and sys.version_info < (3, 8):
+        parser.error("--process-per-track needs Python 3.8+ (multiprocessing.shared_memory)")
+
+    startup.mark("imports done")
     app = QtWidgets.QApplication([])
 
     app.setFont(QtGui.QFont("Mono", 10))
@@ -189,13 +300,28 @@ def main():
     sheight = app.primaryScreen().size().height()
     height = 150
     
-    player = Player()
+    player = Player(processPerTrack=args.process_per_track)
     
     player.resize(swidth, height)
     player.move(0,sheight-height-50)
     
     player.show()
     player.refreshUI()
+    if args.control:
+        # Imported on request only, not to load QtNetwork at every start.
+        from control import ControlServer
+        player.control = ControlServer(player, args.control)
+    for directory, trackNo in args.watch:
+        while len(player.tracks.tracks) < trackNo:
+            player.tracks.addTrack()
+        player.watchFolder.watch(directory, player.tracks.tracks[trackNo - 1])
+    startup.mark("main window shown")
+
+    if args.startup_report:
+        # Report once the event loop has painted the first window.
+        QtCore.QTimer.singleShot(0, lambda: (startup.mark("first window painted"), startup.report()))
+    if not args.no_warm_up:
+        QtCore.QTimer.singleShot(0, startup.warm_up)
 
     app.exec_()
 
@@ -0,0 +1,92 @@
+'''
+ Proxy media for smooth playback of many tracks.
+
+ Clips are transcoded with a local ffmpeg to low resolution, short GOP
+ proxies by a bounded pool of background workers. Proxies are stored in the
+ media cache keyed by the source identity and evicted by size, least
+ recently played first.
+'''
+
+from PyQt5 import QtCore
+import os, subprocess
+
+import mediacache
+
+PROXY_HEIGHT = 540
+# Keyframe every PROXY_GOP frames, cheap to seek and to step through.
+PROXY_GOP = 12
+PROXY_CACHE_MB = 20480
+# Transcoding is heavy, leave most cores to the playback.
+PROXY_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+
+
+class ProxyManager(QtCore.QObject):
+
+    NONE = 0
+    QUEUED = 1
+    BUILDING = 2
+    READY = 3
+    FAILED = 4
+
+    STATUS_TEXT = ("no proxy", "proxy queued", "building proxy", "proxy ready", "proxy failed")
+
+    # mrl of the source and the new status, emitted from worker threads.
+    proxyChanged = QtCore.pyqtSignal(str, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = mediacache.BackgroundJobs("proxies", PROXY_WORKERS)
+        # Status of proxies being processed in this session, by source key.
+        self.status = {}
+
+    def proxyPath(self, key):
+        return mediacache.cache_path('proxies', key, '.mp4')
+
+    def statusOf(self, mrl):
+        try:
+            key = mediacache.source_key(mrl)
+        except OSError:
+            return ProxyManager.FAILED
+        status = self.status.get(key, ProxyManager.NONE)
+        if status in (ProxyManager.QUEUED, ProxyManager.BUILDING, ProxyManager.FAILED):
+            return status
+        # Ready ones may have been evicted since.
+        return ProxyManager.READY if os.path.exists(self.proxyPath(key)) else ProxyManager.NONE
+
+    def request(self, mrl):
+        # Queue the building of the proxy of the media if there is none.
+        if self.statusOf(mrl) != ProxyManager.NONE:
+            return
+        key = mediacache.source_key(mrl)
+        self.status[key] = ProxyManager.QUEUED
+        self.proxyChanged.emit(mrl, ProxyManager.QUEUED)
+        self.jobs.submit(key, self.build, mrl, key)
+
+    def build(self, mrl, key):
+        self.status[key] = ProxyManager.BUILDING
+        self.proxyChanged.emit(mrl, ProxyManager.BUILDING)
+        path = self.proxyPath(key)
+        part = path + '.part.mp4'
+        try:
+            mediacache.run(["ffmpeg", "-y", "-i", mediacache.media_path(mrl), "-map", "0:v:0", "-map", "0:a:0?",
+                            "-vf", f"scale=-2:{PROXY_HEIGHT}", "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+                            "-g", str(PROXY_GOP), "-keyint_min", str(PROXY_GOP), "-sc_threshold", "0", "-pix_fmt", "yuv420p",
+                            "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", part],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            os.replace(part, path)
+        except (OSError, subprocess.CalledProcessError):
+            if os.path.exists(part): os.remove(part)
+            self.status[key] = ProxyManager.FAILED
+            self.proxyChanged.emit(mrl, ProxyManager.FAILED)
+            raise
+        self.status.pop(key, None)
+        self.proxyChanged.emit(mrl, ProxyManager.READY)
+        mediacache.evict('proxies', PROXY_CACHE_MB * 1048576, keep={path})
+
+    def mrlFor(self, mrl):
+        # The mrl of the proxy if it's ready, otherwise the original one.
+        if self.statusOf(mrl) != ProxyManager.READY:
+            return mrl
+        path = self.proxyPath(mediacache.source_key(mrl))
+        mediacache.touch(path)
+        return "file://" + path
@@ -0,0 +1,53 @@
+'''
+ Clock skew estimation between two recordings.
+
+ Recorders with slightly different sample clocks drift apart by tens of ms
+ per hour. The offset is measured by GCC-PHAT at several points spread over
+ the overlap of the clips (in parallel), and a line is fitted to offset vs
+ time: its intercept is the offset at the start of the subject clip, and its
+ slope the rate skew.
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from xcorr import gcc_phat
+
+SKEW_POINTS = 6
+SKEW_WINDOW_SECONDS = 20
+# Each point searches this far around the offset found for the whole clips.
+SKEW_SEARCH_MS = 500
+
+
+def measure_point(subject, reference, p, lag, window, margin):
+    # Offset (samples) at subject sample p, near lag.
+    a = max(p - window // 2, 0)
+    refStart = max(0, a + lag - margin)
+    refEnd = min(len(reference), a + lag + window + margin)
+    local, peak = gcc_phat(subject[a:a + window], reference[refStart:refEnd],
+                           a + lag - margin - refStart, a + lag + margin - refStart)
+    return local + refStart - a, peak
+
+
+def estimate(subject, reference, rate, lag):
+    # Return (offset ms at the start of the subject, skew) from lag, the offset in samples found for the whole clips.
+    # skew is the timeline ms per ms of the subject media minus 1.
+    window = int(rate * SKEW_WINDOW_SECONDS)
+    margin = int(rate * SKEW_SEARCH_MS / 1000)
+    overlapStart = max(0, -lag) + window // 2 + margin
+    overlapEnd = min(len(subject), len(reference) - lag) - window // 2 - margin
+    if overlapEnd - overlapStart < window * 2:
+        print("Overlap too short to estimate the clock skew.")
+        return lag * 1000 / rate, 0.0
+    points = np.linspace(overlapStart, overlapEnd, SKEW_POINTS).astype(np.int64)
+    with ThreadPoolExecutor(max_workers=min(SKEW_POINTS, os.cpu_count() or 1)) as executor:
+        results = list(executor.map(lambda p: measure_point(subject, reference, int(p), lag, window, margin), points))
+    lags = np.array([r[0] for r in results], dtype=np.float64)
+    # Weight the points by how sharp their correlation peak is.
+    weights = np.array([max(r[1], 1e-6) for r in results])
+    slope, intercept = np.polyfit(points.astype(np.float64), lags, 1, w=weights)
+    residual = np.abs(lags - (intercept + slope * points)).max() * 1000 / rate
+    print(f"Clock skew {slope * 1e6:.1f} ppm over {len(points)} points, max residual {residual:.1f} ms.")
+    return float(intercept * 1000 / rate), float(slope)
@@ -0,0 +1,97 @@
+'''
+ Startup timing and lazy loading helpers.
+
+ Heavy modules (the DSP stack used by auto-align, pymediainfo) are imported on
+ first use, and can be warmed up in a background thread once the main window
+ is shown. The import timer gives a `-X importtime` style breakdown so the
+ time to first window can be kept under STARTUP_BUDGET_MS.
+'''
+
+import builtins, sys, threading, time, importlib
+
+# Budget of time-to-first-window in ms.
+STARTUP_BUDGET_MS = 1500
+# Modules warmed up in background after the main window is shown.
+WARM_UP_MODULES = ['pymediainfo', 'numpy', 'alignments']
+
+T0 = time.perf_counter()
+
+_marks = []
+_imports = []   # (depth, module name, self us, cumulative us)
+_stack = []
+_origImport = None
+
+
+def _timedImport(name, globals=None, locals=None, fromlist=(), level=0):
+    if level:
+        return _origImport(name, globals, locals, fromlist, level)
+    if name in sys.modules:
+        # A loaded package can still have submodules to load, as by `from PyQt5 import QtMultimedia`.
+        module = sys.modules[name]
+        new = [f for f in (fromlist or ()) if f != '*' and not hasattr(module, f)]
+        if not new:
+            return _origImport(name, globals, locals, fromlist, level)
+        label = f"{name}.{','.join(new)}"
+    else:
+        label = name
+    _stack.append(0)
+    start = time.perf_counter()
+    try:
+        return _origImport(name, globals, locals, fromlist, level)
+    finally:
+        cumulative = int((time.perf_counter() - start) * 1000000)
+        children = _stack.pop()
+        if _stack: _stack[-1] += cumulative
+        _imports.append((len(_stack), label, cumulative - children, cumulative))
+
+
+def install_import_timer():
+    # Time every first-time import from now on.
+    global _origImport
+    if _origImport is None:
+        _origImport = builtins.__import__
+        builtins.__import__ = _timedImport
+
+
+def uninstall_import_timer():
+    global _origImport
+    if _origImport is not None:
+        builtins.__import__ = _origImport
+        _origImport = None
+
+
+def mark(label):
+    # Record a startup phase, in ms since process start.
+    _marks.append((label, (time.perf_counter() - T0) * 1000))
+
+
+def report(budgetMs=STARTUP_BUDGET_MS, top=25, out=sys.stderr):
+    # Print the phase marks and the most expensive imports.
+    uninstall_import_timer()
+    print("Startup report:", file=out)
+    for label, ms in _marks:
+        print(f"  {ms:9.1f} ms  {label}", file=out)
+    if _imports:
+        print(f"  {'self [us]':>10} | {'cumulative':>10} | imported package", file=out)
+        for depth, name, selfUs, cumUs in sorted(_imports, key=lambda i: i[3], reverse=True)[:top]:
+            print(f"  {selfUs:10} | {cumUs:10} | {'  ' * depth}{name}", file=out)
+    total = _marks[-1][1] if _marks else (time.perf_counter() - T0) * 1000
+    if total > budgetMs:
+        print(f"  Time to first window {total:.1f} ms is OVER the budget of {budgetMs} ms!", file=out)
+    else:
+        print(f"  Time to first window {total:.1f} ms is within the budget of {budgetMs} ms.", file=out)
+    return total
+
+
+def warm_up(modules=WARM_UP_MODULES):
+    # Import the heavy modules in a daemon thread, so the first auto-align
+    # (or clip probing) doesn't pay for it.
+    def load():
+        for m in modules:
+            try:
+                importlib.import_module(m)
+            except ImportError as e:
+                print(f"Warm up of {m} failed: {e}")
+    thread = threading.Thread(target=load, name="warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,97 @@
+'''
+ Streaming spectral landmark aligner for full length recordings.
+
+ Same landmarks as the in-memory pipeline of alignments.py (strongest FFT
+ bins per box), but computed with NumPy over fixed-size chunks of (memory
+ mapped) audio, decoded by the store only as the chunks are read. Offset votes are accumulated in a bounded array chunk by
+ chunk, and the scan stops early once one offset clearly dominates.
+'''
+
+import numpy as np
+
+from alignments import FFT_BIN_SIZE, BOX_HEIGHT, BOX_WIDTH, SAMPLES_PER_BOX
+
+# Reference audio processed per step, rounded to whole boxes.
+CHUNK_SECONDS = 30
+# Early stop when the best offset has this many votes and
+MIN_VOTES = 30
+# is this many times more voted than any other (not adjacent) offset.
+DOMINANCE = 3.0
+
+
+def chunk_samples(rate):
+    boxSamples = FFT_BIN_SIZE * BOX_WIDTH
+    return max(int(rate * CHUNK_SECONDS) // boxSamples, 1) * boxSamples
+
+
+def landmarks(data, start, stop):
+    # Return (freqs, frames) of the strongest bins per box in data[start:stop], start is a whole box.
+    nFrames = (stop - start) // FFT_BIN_SIZE
+    nBoxes = nFrames // BOX_WIDTH
+    if nBoxes == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+    samples = np.asarray(data[start:start + nBoxes * BOX_WIDTH * FFT_BIN_SIZE], dtype=np.float32)
+    mag = np.abs(np.fft.rfft(samples.reshape(-1, FFT_BIN_SIZE), axis=1))[:, :FFT_BIN_SIZE // 2]
+    nBands = mag.shape[1] // BOX_HEIGHT
+    boxes = mag[:, :nBands * BOX_HEIGHT].reshape(nBoxes, BOX_WIDTH, nBands, BOX_HEIGHT).transpose(0, 2, 1, 3).reshape(nBoxes, nBands, -1)
+    top = np.argpartition(boxes, -SAMPLES_PER_BOX, axis=2)[:, :, -SAMPLES_PER_BOX:]
+    box = np.arange(nBoxes).reshape(-1, 1, 1)
+    band = np.arange(nBands).reshape(1, -1, 1)
+    frames = box * BOX_WIDTH + top // BOX_HEIGHT + start // FFT_BIN_SIZE
+    freqs = band * BOX_HEIGHT + top % BOX_HEIGHT
+    return freqs.ravel().astype(np.int32), frames.ravel().astype(np.int64)
+
+
+def fingerprint(data, rate):
+    # Landmarks of the whole audio, processed chunk by chunk. Returned grouped by frequency.
+    step = chunk_samples(rate)
+    parts = [landmarks(data, i, min(i + step, len(data))) for i in range(0, len(data), step)]
+    freqs = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.int32)
+    frames = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+    order = np.argsort(freqs, kind='stable')
+    return freqs[order], frames[order], len(data) // FFT_BIN_SIZE
+
+
+def dominant(votes):
+    # Return (index, votes, runner-up votes) of the best offset, ignoring its neighbours for the runner-up.
+    best = int(np.argmax(votes))
+    runnerUp = max(votes[:max(best - 1, 0)].max(initial=0), votes[best + 2:].max(initial=0))
+    return best, int(votes[best]), int(runnerUp)
+
+
+def stream_delay(subjectPrint, reference, rate, window=None):
+    # Return (delay in frames, votes, reference seconds scanned) so that subject frame t matches reference frame t + delay.
+    # window is an optional (lo, hi) range of the delay in frames.
+    freqsS, framesS, nS = subjectPrint
+    nR = len(reference) // FFT_BIN_SIZE
+    votes = np.zeros(nS + nR, dtype=np.int32)
+    step = chunk_samples(rate)
+    scanned = 0
+    for start in range(0, len(reference), step):
+        if window and ((start + step) // FFT_BIN_SIZE <= window[0] or start // FFT_BIN_SIZE > nS + window[1]):
+            # No frame of this chunk can match within the window.
+            continue
+        freqsR, framesR = landmarks(reference, start, min(start + step, len(reference)))
+        scanned = min(start + step, len(reference))
+        deltas = []
+        for f in np.unique(freqsR):
+            lo, hi = np.searchsorted(freqsS, f, side='left'), np.searchsorted(freqsS, f, side='right')
+            if lo < hi:
+                deltas.append(np.subtract.outer(framesR[freqsR == f], framesS[lo:hi]).ravel())
+        if deltas:
+            deltas = np.concatenate(deltas)
+            if window:
+                deltas = deltas[(deltas >= window[0]) & (deltas <= window[1])]
+            votes += np.bincount(deltas + nS, minlength=len(votes)).astype(np.int32)
+        best, count, runnerUp = dominant(votes)
+        if count >= MIN_VOTES and count >= DOMINANCE * runnerUp:
+            print(f"Offset dominates with {count} votes (runner-up {runnerUp}) after {scanned/rate:.0f}s, stop now.")
+            break
+    best, count, runnerUp = dominant(votes)
+    return best - nS, count, scanned / rate
+
+
+def delay_ms(delay, rate):
+    # Same conversion as getMS() of the in-memory pipeline.
+    samples_per_sec = float(rate) / float(FFT_BIN_SIZE)
+    return int(round(float(delay) / float(samples_per_sec), 4) * 1000)
@@ -0,0 +1,98 @@
+'''
+ Filmstrip thumbnails of the clips on the timeline.
+
+ Frames are extracted in background with one ffmpeg run per clip and zoom
+ level (a power of two seconds between frames), stored in the media cache,
+ and loaded into an in-memory LRU of pixmaps when a visible clip is painted.
+'''
+
+from PyQt5 import QtCore, QtGui
+from collections import OrderedDict
+import os, subprocess
+
+import mediacache
+
+# Height of the extracted frames, drawn scaled into the clip buttons.
+THUMB_HEIGHT = 36
+# Wanted width in pixels of a thumbnail on the timeline, which picks the zoom level.
+THUMB_WIDTH = 32
+# Seconds between frames of the coarsest level.
+MAX_INTERVAL = 4096
+# Decoded pixmaps kept in memory.
+PIXMAP_LRU = 2000
+THUMB_CACHE_MB = 1024
+
+
+class ThumbnailCache(QtCore.QObject):
+
+    # mrl of the clip with new thumbnails, emitted from worker threads.
+    thumbnailsReady = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = mediacache.BackgroundJobs("thumbnails")
+        self.keys = {}
+        # Paths of the frames by (source key, interval), and the failed ones.
+        self.available = {}
+        self.failed = set()
+        self.pixmaps = OrderedDict()
+
+    @staticmethod
+    def interval(msPerPixel):
+        # Seconds between thumbnails for the zoom level.
+        seconds = msPerPixel * THUMB_WIDTH / 1000
+        interval = 1
+        while interval < seconds and interval < MAX_INTERVAL:
+            interval *= 2
+        return interval
+
+    def sourceKey(self, mrl):
+        if mrl not in self.keys:
+            self.keys[mrl] = mediacache.source_key(mrl)
+        return self.keys[mrl]
+
+    def frames(self, mrl, interval):
+        # Paths of the frames every interval seconds of the media, None if not available (then built in background).
+        try:
+            key = self.sourceKey(mrl)
+        except OSError:
+            return None
+        if (key, interval) in self.available:
+            return self.available[(key, interval)]
+        if (key, interval) in self.failed:
+            return None
+        levelDir = os.path.join(mediacache.cache_path('thumbnails', key), f'{interval}s')
+        if os.path.exists(os.path.join(levelDir, 'done')):
+            mediacache.touch(os.path.dirname(levelDir))
+            paths = sorted(os.path.join(levelDir, f) for f in os.listdir(levelDir) if f.endswith('.jpg'))
+            self.available[(key, interval)] = paths
+            return paths
+        self.jobs.submit((key, interval), self.build, mrl, key, interval, levelDir)
+        return None
+
+    def build(self, mrl, key, interval, levelDir):
+        os.makedirs(levelDir, exist_ok=True)
+        try:
+            # Only keyframes are decoded, a thumbnail doesn't need to be exact.
+            mediacache.run(["ffmpeg", "-y", "-skip_frame", "nokey", "-i", mediacache.media_path(mrl), "-an",
+                            "-vf", f"fps=1/{interval},scale=-2:{THUMB_HEIGHT}", "-q:v", "5", os.path.join(levelDir, "%05d.jpg")],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            self.failed.add((key, interval))
+            raise
+        open(os.path.join(levelDir, 'done'), 'w').close()
+        mediacache.touch(os.path.dirname(levelDir))
+        self.thumbnailsReady.emit(mrl)
+        mediacache.evict('thumbnails', THUMB_CACHE_MB * 1048576, keep={os.path.dirname(levelDir)})
+
+    def pixmap(self, path):
+        # Decoded pixmap of a frame, must be called in the GUI thread.
+        pm = self.pixmaps.get(path)
+        if pm == None:
+            pm = QtGui.QPixmap(path)
+            self.pixmaps[path] = pm
+            if len(self.pixmaps) > PIXMAP_LRU:
+                self.pixmaps.popitem(last=False)
+        else:
+            self.pixmaps.move_to_end(path)
+        return pm
@@ -0,0 +1,74 @@
+'''
+ Start time of recordings from their metadata.
+
+ Cameras write a creation time and/or a SMPTE timecode of the first frame,
+ which MediaInfo exposes. The absolute creation time is preferred; a clip
+ with only a timecode gets its time of day (so timecode-only cameras line up
+ among themselves on the same day). A per-track clock offset corrects
+ cameras whose clock is off.
+'''
+
+import re
+from datetime import datetime, timedelta, timezone
+
+# Creation time fields of MediaInfo, by preference.
+DATE_FIELDS = ('comapplequicktimecreationdate', 'recorded_date', 'encoded_date', 'tagged_date')
+TIMECODE_FIELDS = ('time_code_of_first_frame', 'timecode_of_first_frame')
+
+# Kinds of start times, only the ones of the same kind can be compared.
+EPOCH = 'epoch'
+TIME_OF_DAY = 'timeOfDay'
+
+
+def parse_date(value):
+    # Epoch ms of a MediaInfo date like "UTC 2023-05-01 08:20:30", "2023-05-01T10:20:30+0200", None if unparsable.
+    value = str(value).strip()
+    value = value.replace('UTC', '').strip().replace(' ', 'T')
+    m = re.match(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$', value)
+    if not m:
+        return None
+    try:
+        dt = datetime.strptime(m.group(1), '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+    if m.group(2):
+        dt = dt.replace(microsecond=int(float(m.group(2)) * 1000000))
+    tz = m.group(3)
+    if tz and tz != 'Z':
+        sign = -1 if tz[0] == '-' else 1
+        digits = tz[1:].replace(':', '')
+        dt = dt.replace(tzinfo=timezone(sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))))
+    else:
+        # No zone (or Z): MediaInfo dates are in UTC.
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def parse_timecode(value, fps):
+    # ms of the day of a timecode like "10:20:30:12" or "10:20:30;12" (drop frame), None if unparsable.
+    m = re.match(r'(\d{1,2}):(\d{2}):(\d{2})[:;.](\d{2})$', str(value).strip())
+    if not m:
+        return None
+    h, mi, s, f = (int(g) for g in m.groups())
+    return ((h * 60 + mi) * 60 + s) * 1000 + int(round(f * 1000 / (fps or 25)))
+
+
+def start_time_ms(mi):
+    # Return (start time, kind) of the media parsed by MediaInfo: epoch ms (EPOCH) or, for timecode only,
+    # ms of the day (TIME_OF_DAY); (None, None) if unknown.
+    fps = None
+    timecode = None
+    for t in mi.tracks:
+        if t.track_type == "Video" and getattr(t, 'frame_rate', None):
+            fps = float(t.frame_rate)
+    for t in mi.tracks:
+        if t.track_type == "General":
+            for f in DATE_FIELDS:
+                if getattr(t, f, None):
+                    ms = parse_date(getattr(t, f))
+                    if ms != None:
+                        return ms, EPOCH
+        for f in TIMECODE_FIELDS:
+            if timecode == None and getattr(t, f, None):
+                timecode = parse_timecode(getattr(t, f), fps)
+    return (timecode, TIME_OF_DAY) if timecode != None else (None, None)
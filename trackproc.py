@@ -0,0 +1,297 @@
+'''
+ Process-per-track playback.
+
+ In this (optional) mode every track plays in its own worker process, with
+ its own Qt multimedia instance and player window, so decoding and event
+ handling are spread across cores and a busy GUI thread stalls no track.
+
+ The main Tracks timeline publishes the master clock in shared memory, each
+ worker follows it on its own: opens and switches clips, seeks, and corrects
+ its drift. Clips, marker and sync requests go over a pipe.
+'''
+
+from PyQt5 import QtCore
+import multiprocessing, struct, time
+
+# seq, playing, resumeFrom (ms), resumeMomentNS, speed
+CLOCK_FORMAT = '<Qqqqd'
+CLOCK_SIZE = struct.calcsize(CLOCK_FORMAT)
+
+# How often a worker looks at the clock.
+WORKER_TICK_MS = 20
+# A worker re-seeks when its position is off the clock by more than this.
+DRIFT_MS = 80
+DRIFT_CHECK_MS = 1000
+# How often a worker reports its position to the main process.
+REPORT_MS = 500
+# Up to this speed the players play at a rate, above it the tracks step through keyframes (trick play).
+RATE_SPEED_MAX = 2
+# Interval in ms between the keyframes shown in trick play.
+TRICK_STEP_MS = 100
+
+
+class MasterClock:
+    # The timeline position in shared memory, written by the main process only, guarded by a sequence number (seqlock).
+
+    def __init__(self, name=None):
+        # Python 3.8+, only needed in process-per-track mode.
+        from multiprocessing import shared_memory
+        if name == None:
+            self.shm = shared_memory.SharedMemory(create=True, size=CLOCK_SIZE)
+            self.owner = True
+            self.seq = 0
+            struct.pack_into(CLOCK_FORMAT, self.shm.buf, 0, 0, 0, 0, 0, 1.0)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Before Python 3.13 the resource tracker of the worker would unlink it at exit.
+                from multiprocessing import resource_tracker
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            self.owner = False
+        self.name = self.shm.name
+
+    def publish(self, playing, resumeFrom, resumeMomentNS, speed=1):
+        self.seq += 1
+        struct.pack_into('<Q', self.shm.buf, 0, self.seq * 2 - 1)
+        struct.pack_into(CLOCK_FORMAT, self.shm.buf, 0, self.seq * 2 - 1, int(playing), int(resumeFrom), int(resumeMomentNS), float(speed))
+        struct.pack_into('<Q', self.shm.buf, 0, self.seq * 2)
+
+    def read(self):
+        # Return (seq, playing, resumeFrom, resumeMomentNS, speed), retried while being written.
+        while True:
+            state = struct.unpack_from(CLOCK_FORMAT, self.shm.buf, 0)
+            if state[0] % 2 == 0 and struct.unpack_from('<Q', self.shm.buf, 0)[0] == state[0]:
+                return state[0], bool(state[1]), state[2], state[3], state[4]
+
+    def position(self):
+        seq, playing, resumeFrom, resumeMomentNS, speed = self.read()
+        if playing:
+            return resumeFrom + int((time.time_ns() - resumeMomentNS) / 1000000 * speed)
+        return resumeFrom
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class TrackProcess:
+    # The main process side of a track worker.
+
+    def __init__(self, trackNo, clockName, geometry):
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, childConn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(childConn, clockName, trackNo, geometry), name=f"track-{trackNo}", daemon=True)
+        self.process.start()
+        childConn.close()
+
+    def send(self, *msg):
+        try:
+            self.conn.send(msg)
+        except (OSError, EOFError):
+            print(f"{self.process.name} is gone.")
+
+    def sendClips(self, track):
+        self.send('clips', [{'mrl': c.playMrl(), 'name': c.name, 'sPos': c.sPos, 'ePos': c.ePos, 'skew': c.skew} for c in track.clips])
+
+    def messages(self):
+        msgs = []
+        try:
+            while self.conn.poll():
+                msgs.append(self.conn.recv())
+        except (OSError, EOFError):
+            pass
+        return msgs
+
+    def close(self):
+        self.send('close')
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class WorkerClip:
+    # A clip as seen by a worker, shifting it is done by the main process.
+
+    def __init__(self, worker, idx, d):
+        self.worker = worker
+        self.idx = idx
+        self.mrl = d['mrl']
+        self.name = d['name']
+        self.sPos = d['sPos']
+        self.ePos = d['ePos']
+        self.skew = d['skew']
+
+    def mediaPos(self, tPos):
+        return int(round((tPos - self.sPos) / (1 + self.skew)))
+
+    def adjustPos(self, shiftMS):
+        self.worker.conn.send(('shift', self.idx, shiftMS))
+
+
+class TrackWorker(QtCore.QObject):
+    # Plays a track in a worker process, following the master clock.
+
+    def __init__(self, conn, clock, trackNo, geometry):
+        super().__init__()
+        from PyQt5 import QtMultimedia
+        from tracks import PlayerWidget
+        self.conn = conn
+        self.clock = clock
+        self.no = trackNo
+        self.clips = []
+        self.curClip = None
+        self.seq = None
+        self.speed = 1
+        self.lastDriftCheck = 0
+        self.lastReport = 0
+        # Trick play: when the last keyframe was shown, and which.
+        self.lastTrickStep = 0
+        self.trickShown = None
+
+        self.player = QtMultimedia.QMediaPlayer()
+        self.playerW = PlayerWidget()
+        self.playerW.setWindowTitle(f"Track {self.no}")
+        self.playerW.setGeometry(*geometry)
+        self.player.setVideoOutput(self.playerW.videoframe)
+        self.playerW.setTrack(self)
+        # The volume known by the main process, changes by the keys are reported to it.
+        self.reportedVolume = self.player.volume()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(WORKER_TICK_MS)
+
+    def clipAt(self, pos):
+        for c in self.clips:
+            if c.sPos <= pos and c.ePos > pos:
+                return c
+        return None
+
+    def load(self, clip, pos):
+        from PyQt5 import QtMultimedia
+        if self.curClip == None or self.curClip.mrl != clip.mrl:
+            self.player.setMedia(QtMultimedia.QMediaContent(QtCore.QUrl(clip.mrl)))
+        self.curClip = clip
+        self.player.setPosition(clip.mediaPos(pos))
+        self.player.setPlaybackRate(self.speed / (1 + clip.skew))
+        self.playerW.setWindowTitle(f'Track {self.no}: {clip.name}')
+        self.playerW.show()
+
+    def tick(self):
+        from PyQt5 import QtMultimedia
+        while self.conn.poll():
+            if not self.handle(self.conn.recv()):
+                return
+        if self.player.volume() != self.reportedVolume:
+            self.reportedVolume = self.player.volume()
+            self.conn.send(('volume', self.reportedVolume))
+        seq, playing, resumeFrom, resumeMomentNS, self.speed = self.clock.read()
+        pos = self.clock.position()
+        clip = self.clipAt(pos)
+        if time.monotonic() - self.lastReport > REPORT_MS / 1000:
+            self.lastReport = time.monotonic()
+            self.report(pos)
+        trick = playing and self.speed > RATE_SPEED_MAX
+        if seq != self.seq:
+            # Played, paused, sought or speed changed by the timeline.
+            self.seq = seq
+            self.trickShown = None
+            if clip == None:
+                self.closeMedia()
+                return
+            self.load(clip, pos)
+            self.player.setMuted(trick)
+            if playing and not trick:
+                self.player.play()
+            else:
+                self.player.pause()
+        elif trick:
+            self.trickStep(clip, pos)
+        elif playing and clip != self.curClip:
+            # Transition scheduled by the worker itself.
+            if clip == None:
+                self.closeMedia()
+            else:
+                self.load(clip, pos)
+                self.player.play()
+        elif playing and clip and time.monotonic() - self.lastDriftCheck > DRIFT_CHECK_MS / 1000:
+            self.lastDriftCheck = time.monotonic()
+            if self.player.state() == QtMultimedia.QMediaPlayer.PlayingState:
+                drift = self.player.position() - clip.mediaPos(pos)
+                if abs(drift) > DRIFT_MS:
+                    print(f'Track.{self.no}: drifted {drift} ms, re-seek.')
+                    self.player.setPosition(clip.mediaPos(pos))
+
+    def trickStep(self, clip, pos):
+        # Show the keyframe at the clock position, at most one every TRICK_STEP_MS.
+        import keyframes
+        if time.monotonic() - self.lastTrickStep < TRICK_STEP_MS / 1000:
+            return
+        self.lastTrickStep = time.monotonic()
+        if clip == None:
+            self.closeMedia()
+            return
+        if clip != self.curClip:
+            self.load(clip, pos)
+            self.player.pause()
+            self.trickShown = None
+        target = keyframes.keyframe_at(clip.mrl, clip.mediaPos(pos))
+        if target != self.trickShown:
+            self.trickShown = target
+            self.player.setPosition(target)
+
+    def closeMedia(self):
+        # Nothing to show: hide the window and release the decoder of the media.
+        from PyQt5 import QtMultimedia
+        if self.player.mediaStatus() != QtMultimedia.QMediaPlayer.NoMedia:
+            self.player.setMedia(QtMultimedia.QMediaContent())
+        self.curClip = None
+        self.playerW.hide()
+
+    def report(self, pos):
+        # ('position', clip index, media position, drift against the clock, media open), for the metrics.
+        from PyQt5 import QtMultimedia
+        c = self.curClip
+        isOpen = self.player.mediaStatus() not in (QtMultimedia.QMediaPlayer.NoMedia, QtMultimedia.QMediaPlayer.UnknownMediaStatus)
+        if c:
+            self.conn.send(('position', c.idx, self.player.position(), self.player.position() - c.mediaPos(pos), isOpen))
+        else:
+            self.conn.send(('position', None, None, None, isOpen))
+
+    def handle(self, msg):
+        if msg[0] == 'clips':
+            old = self.curClip
+            self.clips = [WorkerClip(self, i, d) for i, d in enumerate(msg[1])]
+            # Keep the media open, re-seek only if the current clip has moved.
+            self.curClip = next((c for c in self.clips if c.mrl == old.mrl), None) if old else None
+            if self.curClip == None or self.curClip.sPos != old.sPos:
+                self.seq = None
+        elif msg[0] == 'volume':
+            self.player.setVolume(msg[1])
+            self.reportedVolume = msg[1]
+        elif msg[0] == 'close':
+            self.timer.stop()
+            self.player.stop()
+            self.playerW.close()
+            self.clock.close()
+            QtCore.QCoreApplication.quit()
+            return False
+        return True
+
+    # Called by the PlayerWidget.
+    def setMarker(self, newMarker=True):
+        self.conn.send(('marker', self.clock.position()) if newMarker else ('clearMarker',))
+
+    def syncClipToMarker(self):
+        if self.curClip:
+            self.conn.send(('sync', self.curClip.idx, self.player.position()))
+
+
+def worker_main(conn, clockName, trackNo, geometry):
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication([])
+    worker = TrackWorker(conn, MasterClock(clockName), trackNo, geometry)
+    app.exec_()
@@ -1,10 +1,31 @@
 from PyQt5 import QtWidgets, QtGui, QtCore, QtMultimedia, QtMultimediaWidgets
 import os, time, datetime, operator
-from pymediainfo import MediaInfo
+from collections import deque
 from urllib.parse import unquote
 from math import floor
 
-from alignments import AdjustClipPosDialog
+import keyframes, timecode
+from proxies import ProxyManager
+from thumbnails import ThumbnailCache
+from waveforms import WaveformCache
+from trackproc import MasterClock, TrackProcess, RATE_SPEED_MAX, TRICK_STEP_MS
+
+# pymediainfo and alignments (with NumPy) are heavy, they are imported
+# on first use to keep the startup fast, see startup.py.
+
+def probe(url):
+    # Return (mediatype, duration, start time, start time kind) of the media, blocking.
+    from pymediainfo import MediaInfo
+    mi = MediaInfo.parse(url)
+    mediatype = Clip.EMPTY
+    duration = 0
+    for t in mi.tracks:
+        if t.track_type == "Video":
+            mediatype = Clip.VIDEO
+            duration = t.duration
+            break
+    return (mediatype, duration) + timecode.start_time_ms(mi)
+
 
 class Clip(QtWidgets.QPushButton):
     
@@ -13,27 +34,29 @@ class Clip(QtWidgets.QPushButton):
 
     SEEKSTEP = 1000
 
-    def __init__(self, parent=None, url='', sPos=0, name=None):
+    def __init__(self, parent=None, url='', sPos=0, name=None, skew=0.0, info=None):
+        # info is the result of probe(url) if already done.
         super().__init__(parent)
 
         self.sPos = sPos
-        self.mediatype = Clip.EMPTY
-        self.duration = 0
+        # Clock skew against the timeline: timeline ms per ms of the media, minus 1.
+        self.skew = skew
         
         if url[0] == '/':
             self.mrl = "file://" + url
         else:
             self.mrl = url
 
-        mi = MediaInfo.parse(url)
-        for t in mi.tracks:
-            if t.track_type == "Video":
-                self.mediatype = Clip.VIDEO
-                self.duration = t.duration
-                break
+        # The recording start time from the metadata (ms) is None if unknown.
+        # startKind tells if it's an epoch time or a time of the day (timecode.EPOCH / TIME_OF_DAY).
+        self.mediatype, self.duration, self.startTime, self.startKind = info if info else probe(url)
+
+        # Index the keyframes in background for seeking.
+        if self.mediatype == Clip.VIDEO:
+            keyframes.request_index(self.mrl)
 
         # calculate the new end position with video length.
-        self.ePos = self.sPos + self.duration
+        self.ePos = self.sPos + self.tracksDuration()
         self.name = name if name else unquote(os.path.basename(self.mrl))
         self.setText(self.name)
 
@@ -45,14 +68,101 @@ class Clip(QtWidgets.QPushButton):
         if timeInMS == None:
             timeInMS = self.duration
         return str(datetime.timedelta(seconds=timeInMS/1000))
+
+    def mediaPos(self, tPos):
+        # Position in the media at the given position of the tracks, compensating the clock skew.
+        return int(round((tPos - self.sPos) / (1 + self.skew)))
+
+    def tracksPos(self, mediaPos):
+        return self.sPos + int(round(mediaPos * (1 + self.skew)))
+
+    def tracksDuration(self):
+        # The length of the clip on the timeline, longer or shorter than the media by its clock skew.
+        return self.tracksPos(self.duration) - self.sPos
+
+    def setSkew(self, skew):
+        self.skew = skew
+        self.ePos = self.sPos + self.tracksDuration()
+        track = self.parent()
+        track.ePos = max(c.ePos for c in track.clips)
     
+    def playMrl(self):
+        # The mrl to play: the proxy of the media when proxies are used (or in trick play) and it's ready.
+        tracks = self.parent().parent()
+        if tracks.useProxies or tracks.trickPlay():
+            return tracks.proxies.mrlFor(self.mrl)
+        return self.mrl
+
+    def proxyStatus(self):
+        return self.parent().parent().proxies.statusOf(self.mrl)
+
+    def keyframeIndex(self):
+        # The KeyframeIndex of the media played, None if it's not (yet) available.
+        return keyframes.get_index(self.playMrl())
+
+    def paintEvent(self, e):
+        super().paintEvent(e)
+        # Draw the filmstrip and the waveform at the zoom level, only the exposed part of the clip.
+        if self.duration <= 0 or self.width() <= 0:
+            return
+        painter = QtGui.QPainter(self)
+        drawn = self.drawFilmstrip(painter, e.rect())
+        drawn = self.drawWaveform(painter, e.rect()) or drawn
+        if drawn:
+            painter.setOpacity(1)
+            painter.drawText(self.rect(), QtCore.Qt.AlignCenter, self.text())
+        painter.end()
+
+    def drawFilmstrip(self, painter, rect):
+        w = self.width()
+        thumbs = self.parent().parent().thumbnails
+        interval = ThumbnailCache.interval(self.duration / w)
+        paths = thumbs.frames(self.mrl, interval)
+        if not paths:
+            return False
+        tw = w * interval * 1000 / self.duration
+        h = self.height()
+        painter.setOpacity(0.6)
+        first = int(rect.left() // tw)
+        last = min(len(paths) - 1, int(rect.right() // tw))
+        for i in range(first, last + 1):
+            pm = thumbs.pixmap(paths[i])
+            x = int(i * tw)
+            painter.setClipRect(x, 0, int(tw) + 1, h)
+            painter.drawPixmap(QtCore.QRect(x, 0, int(pm.width() * h / max(pm.height(), 1)), h), pm)
+        painter.setClipping(False)
+        return True
+
+    def drawWaveform(self, painter, rect):
+        waveform = self.parent().parent().waveforms.get(self.mrl)
+        if waveform == None:
+            return False
+        w = self.width()
+        left = max(rect.left(), 0)
+        right = min(rect.right() + 1, w)
+        if right <= left:
+            return False
+        mins, maxs = waveform.peaks(self.duration * left / w, self.duration * right / w, right - left)
+        mid = self.height() / 2
+        scale = mid / 128
+        painter.setOpacity(0.8)
+        painter.setPen(QtGui.QColor("#1F4E79"))
+        for x in range(len(mins)):
+            painter.drawLine(left + x, int(mid - maxs[x] * scale), left + x, int(mid - mins[x] * scale))
+        return True
+
     def adjustPosDialog(self):
-        msShift, choose = AdjustClipPosDialog.getMsShift(self)
+        from alignments import AdjustClipPosDialog
+        msShift, skew, choose = AdjustClipPosDialog.getMsShift(self)
         if choose == QtWidgets.QDialog.Accepted:
-            self.adjustPos(msShift)
+            # The skew found goes with the position, not applied to a clip left in place.
+            if self.adjustPos(msShift) and skew != None:
+                print(f"Set clock skew of {self.name} to {skew * 1e6:.1f} ppm.")
+                self.setSkew(skew)
             self.parent().trackUpdated.emit()
 
     def adjustPos(self, shiftMS):
+        # Move the clip and the next ones of the track, return False if refused.
         print (f'Move {self.name} by {shiftMS} ms.')
         siblings = self.parent().clips
         # Get the index of current clip, as it must has existed.
@@ -65,7 +175,7 @@ class Clip(QtWidgets.QPushButton):
             msg.setWindowTitle("Error")
             msg.setStandardButtons(QtWidgets.QMessageBox.Ok)
             msg.exec_()
-            return
+            return False
         while idx < len(siblings):
             siblings[idx].sPos += shiftMS
             siblings[idx].ePos += shiftMS
@@ -73,6 +183,7 @@ class Clip(QtWidgets.QPushButton):
         # Update the track length.
         self.parent().ePos = siblings[idx-1].ePos
         print ("done.")
+        return True
         
 
 class PlayerWidget(QtWidgets.QWidget):
@@ -125,6 +236,16 @@ class Track(QtWidgets.QLabel):
 
     # Custom Signals
     trackUpdated = QtCore.pyqtSignal()
+
+    # A seek not landed in this time is taken as lost while scrubbing.
+    SEEK_TIMEOUT_NS = 250000000
+
+    # Clips with clock skew are checked every SKEW_CHECK_MS, and re-sought when off by SKEW_RESEEK_MS.
+    SKEW_CHECK_MS = 5000
+    SKEW_RESEEK_MS = 40
+
+    # How many of the last clip transitions keep their lateness.
+    LATENESS_SAMPLES = 20
     
     def __init__(self, parent=None, trackNo=1):
         super().__init__(parent)
@@ -134,10 +255,24 @@ class Track(QtWidgets.QLabel):
         # Track has no duration, they share the max duration of tracks.
         self.ePos = 0
 
+        # Clock offset (ms) of the camera of the track, added to the time codes of its clips.
+        self.clockOffset = 0
+
         self.clips = []
 
         self.curClip = None
         self.nextClip = None
+        # The mrl opened in the player, to avoid reopening the same media.
+        self.loadedMrl = None
+        # ms between the tracks position and the frame the last seek landed on.
+        self.landingError = 0
+
+        # Scrubbing: the (target, time in ns) of the seek in flight, and the latest target waiting for it.
+        self.seekInFlight = None
+        self.seekQueued = None
+
+        # ms the scheduled clips started after their position in the tracks, the latest ones.
+        self.transitionLateness = deque(maxlen=Track.LATENESS_SAMPLES)
 
         self.setContentsMargins(0,0,0,0)
         self.setText(f"Track {trackNo}")
@@ -150,12 +285,7 @@ class Track(QtWidgets.QLabel):
 
         self.setAcceptDrops(True)
 
-        # the QT player
-        self.player = QtMultimedia.QMediaPlayer()
-
-        # the Player Window
-        self.playerW = PlayerWidget()
-        self.playerW.setWindowTitle(f"Track {self.no}")
+        # The player window geometry.
         qs = QtWidgets.QApplication.primaryScreen()
         swidth = qs.availableSize().width()
         sheight = qs.availableSize().height()
@@ -166,24 +296,54 @@ class Track(QtWidgets.QLabel):
             toRight = tw
         else:
             toRight = 0
-        self.playerW.setGeometry(toRight, toTop, tw, th)
-        # print(f"Resize player window to {tw}x{th}")
-        self.player.setVideoOutput(self.playerW.videoframe)
+
+        # In process-per-track mode, the playing is done by a worker process following the master clock,
+        # with its own player and window, then there's none here.
+        self.worker = None
+        self.player = None
+        self.playerW = None
+        # The volume of the player of the worker, and its (clip index, media position, drift, media open), as it reports them.
+        self.workerVolume = 100
+        self.workerState = None
+        if parent.processPerTrack:
+            self.worker = TrackProcess(trackNo, parent.clock.name, (toRight, toTop, tw, th))
+        else:
+            # the QT player
+            self.player = QtMultimedia.QMediaPlayer()
+
+            # the Player Window
+            self.playerW = PlayerWidget()
+            self.playerW.setWindowTitle(f"Track {self.no}")
+            self.playerW.setGeometry(toRight, toTop, tw, th)
+            # print(f"Resize player window to {tw}x{th}")
+            self.player.setVideoOutput(self.playerW.videoframe)
 
         # Timer use for play next clip.
         self.timer = QtCore.QTimer(self)
         self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.playSchedClip)
 
-        self.player.stateChanged.connect(self.playerStateChange)
-        self.playerW.setTrack(self)
-        self.playerW.show()
+        self.skewTimer = QtCore.QTimer(self)
+        self.skewTimer.setInterval(Track.SKEW_CHECK_MS)
+        self.skewTimer.timeout.connect(self.checkSkew)
+
+        # Trick play steps through the keyframes instead of playing, the last keyframe shown is trickShown.
+        self.trickTimer = QtCore.QTimer(self)
+        self.trickTimer.setInterval(TRICK_STEP_MS)
+        self.trickTimer.timeout.connect(self.trickStep)
+        self.trickShown = None
+
+        if not self.worker:
+            self.player.stateChanged.connect(self.playerStateChange)
+            self.player.positionChanged.connect(self.seekLanded)
+            self.playerW.setTrack(self)
+            self.playerW.show()
 
 
     def addClips(self, clips):
         # Create new Clips from list of dictionary and added them to track.
         for c in clips:
-            clip = Clip(self, c['url'], sPos=c['startPosition'], name=c['name'])
+            clip = Clip(self, c['url'], sPos=c['startPosition'], name=c['name'], skew=c.get('skew', 0.0))
             self.clips.append(clip)
             # print(f"{clip.name} ({clip.durMsStr()}) has been added to Track {self.no} (with a width {self.width()}). ")
 
@@ -198,6 +358,40 @@ class Track(QtWidgets.QLabel):
         self.mainWindow.statusBar().showMessage(f"{clip.name} ({clip.durMsStr()}) has been appended to Track {self.no} . ")
         # print(f"{clip.name} ({clip.durMsStr()}) has been appended to Track {self.no} (with a width {self.width()}). ")
 
+    def canPlace(self, sPos, duration):
+        # If a clip can be placed there without overlapping the others.
+        if sPos < 0:
+            return False
+        for c in self.clips:
+            if sPos <= c.ePos and sPos + duration >= c.sPos:
+                return False
+        return True
+
+    def insertClip(self, clip):
+        # Insert a clip at its position, the clips stay sorted.
+        idx = 0
+        while idx < len(self.clips) and self.clips[idx].sPos < clip.sPos:
+            idx += 1
+        self.clips.insert(idx, clip)
+        self.ePos = max(self.ePos, clip.ePos)
+        self.mainWindow.statusBar().showMessage(f"{clip.name} ({clip.durMsStr()}) has been placed at {clip.durMsStr(clip.sPos)} of Track {self.no} by its time code. ")
+
+    def placeClip(self, clip):
+        # Place the clip by its time code if possible, otherwise append it.
+        sPos = self.parent().timecodePos(clip, self)
+        if sPos != None and self.canPlace(sPos, clip.tracksDuration()):
+            clip.sPos = sPos
+            clip.ePos = sPos + clip.tracksDuration()
+            self.insertClip(clip)
+        else:
+            clip.sPos = self.ePos + 1 # Added 1ms to avoid timer overlapping.
+            clip.ePos = clip.sPos + clip.tracksDuration()
+            self.appendClip(clip)
+
+    def mouseDoubleClickEvent(self, e):
+        offset, ok = QtWidgets.QInputDialog.getInt(self, f"Track {self.no}", "Clock offset of the camera (ms), added to the time codes of the clips dropped:", self.clockOffset)
+        if ok: self.clockOffset = offset
+
     
     def getRightPixByDur(self, dur):
         tWidth = self.width()
@@ -211,12 +405,17 @@ class Track(QtWidgets.QLabel):
         self.clips.sort(key=operator.attrgetter('sPos'))
         # Ensure total duration in track is updated for correct calculating
         for c in self.clips:
-            c.setContentsMargins(0,0,0,0)
-            # c.setCheckable(True)
-            c.setToolTip(f'{c.durMsStr(c.sPos)} -> {c.durMsStr(c.ePos)}\n{c.name}({c.durMsStr()})')
-            c.setGeometry(QtCore.QRect(QtCore.QPoint(self.getRightPixByDur(c.sPos), 0), QtCore.QSize(self.getRightPixByDur(c.duration), 18)))
-            c.show()
-            # print(f'Draw a box of {self.getRightPixByDur(c.duration)}x18 and placed at {self.getRightPixByDur(c.sPos)} pix from right for {c.name}({c.duration})')
+            self.placeClipBtn(c)
+
+    def placeClipBtn(self, c):
+        c.setContentsMargins(0,0,0,0)
+        # c.setCheckable(True)
+        tip = f'{c.durMsStr(c.sPos)} -> {c.durMsStr(c.ePos)}\n{c.name}({c.durMsStr()})'
+        if self.parent().useProxies: tip += f'\n({ProxyManager.STATUS_TEXT[c.proxyStatus()]})'
+        c.setToolTip(tip)
+        c.setGeometry(QtCore.QRect(QtCore.QPoint(self.getRightPixByDur(c.sPos), 0), QtCore.QSize(self.getRightPixByDur(c.tracksDuration()), 18)))
+        c.show()
+        # print(f'Draw a box of {self.getRightPixByDur(c.duration)}x18 and placed at {self.getRightPixByDur(c.sPos)} pix from right for {c.name}({c.duration})')
 
     def getClipsByPos(self, tpos):
         # return the current clip and next clip at pos of tracks, if NA, return None.
@@ -233,32 +432,88 @@ class Track(QtWidgets.QLabel):
                 break
         return [cC, nC]
 
+    def loadClip(self, clip):
+        # Open the media (or its proxy) of the clip in the player, unless it's already there.
+        # Return True if it has been (re)opened, then it's at 0.
+        mrl = clip.playMrl()
+        self.playerW.setWindowTitle(f'Track {self.no}: {clip.name}')
+        if self.loadedMrl != mrl:
+            self.player.setMedia(QtMultimedia.QMediaContent(QtCore.QUrl(mrl)))
+            self.loadedMrl = mrl
+            return True
+        return False
+
     def play(self, tPos):
         # Play the current media of track from given position(of the Tracks).
-        self.player.setMedia(QtMultimedia.QMediaContent(QtCore.QUrl(self.curClip.mrl)))
+        self.seekInFlight = None
+        self.seekQueued = None
+        opened = self.loadClip(self.curClip)
         # set the position of media if appliable (A/V)
         # calculated by minus the currnet postion and clip sPos
-        absPos = tPos - self.curClip.sPos
-        if absPos > 1000:
-            self.player.setPosition(absPos)
-            print(f'Seeked to {absPos} of {self.curClip.name}, playing...')
+        absPos = self.curClip.mediaPos(tPos)
+        index = self.curClip.keyframeIndex()
+        if index == None:
+            # Not indexed yet, don't pay for seeking in the first second of a media just opened.
+            if absPos > 1000 or not opened:
+                self.player.setPosition(absPos)
+                print(f'Seeked to {absPos} of {self.curClip.name}, playing...')
+            self.landingError = absPos if absPos <= 1000 and opened else 0
+        else:
+            strategy, target, landing = index.seekPlan(absPos)
+            # A media left open is anywhere, it's always sought.
+            if strategy != keyframes.KeyframeIndex.SEEK_NONE or not opened:
+                self.player.setPosition(target)
+            # How far the frame shown is behind the tracks position.
+            self.landingError = absPos - landing
+            print(f'Seeked to {target} of {self.curClip.name} ({("no seek", "keyframe", "accurate")[strategy]}), landing {self.landingError} ms behind, playing...')
         # print(f"Track.{self.no}: Player state: {self.player.state()}")
-        self.playerW.setWindowTitle(f'Track {self.no}: {self.curClip.name}')
         self.playerW.show()
+        self.applyRate()
         self.player.play()
         self.playerW.setWindowState(QtCore.Qt.WindowActive)
 
+    def applyRate(self):
+        # Play at the speed of the tracks, compensating the clock skew of the current clip, and re-seeks if it's not enough.
+        self.player.setPlaybackRate(self.parent().pbSpeedF / (1 + self.curClip.skew))
+        if self.curClip.skew:
+            self.skewTimer.start()
+        else:
+            self.skewTimer.stop()
+
+    def checkSkew(self):
+        if self.curClip == None or self.player.state() != QtMultimedia.QMediaPlayer.PlayingState:
+            return
+        expected = self.curClip.mediaPos(self.parent().getCurPos())
+        drift = self.player.position() - expected
+        if abs(drift) > Track.SKEW_RESEEK_MS:
+            print(f'Track.{self.no}: {self.curClip.name} drifted {drift} ms, re-seek.')
+            self.player.setPosition(expected)
+
     def schNC(self, nextClip):
         # Set the timer for next clip (playSchedClip()).
         self.nextClip = nextClip
         tpos = self.parent().getCurPos() 
-        intV = self.nextClip.sPos - tpos
+        intV = int((self.nextClip.sPos - tpos) / self.parent().pbSpeedF)
         self.timer.setInterval(intV)
         self.timer.start()
         print(f'Track {self.no}: Timer set for {nextClip.name}, with a interval of {intV}.')
     
     def playFrom(self, tpos):
         # Play from the given position. 
+        # The worker follows the master clock by itself.
+        if self.worker:
+            return
+        if self.parent().trickPlay():
+            # Step through the keyframes, the clips are switched by the steps.
+            # A scrub left pending from the pause must not land over the steps.
+            self.seekInFlight = None
+            self.seekQueued = None
+            self.player.setMuted(True)
+            self.trickShown = None
+            self.trickStep()
+            self.trickTimer.start()
+            return
+        self.player.setMuted(False)
         # If not a empty track:
         if len(self.clips) > 0:
             # Play from given position of the tracks.
@@ -271,8 +526,7 @@ class Track(QtWidgets.QLabel):
             if cP == None:
                 # Schedule the next clip if there has.
                 print(f'Track.{self.no}: Nothing to play now.')
-                self.curClip = None
-                self.playerW.hide()
+                self.closeMedia()
             elif self.curClip == cP:
                 # If it's the current Clip of the track, then open the media for play.
                 print(f'Track.{self.no}: Resume the current media {self.curClip.name} from tracks postion {tpos}.')
@@ -287,13 +541,23 @@ class Track(QtWidgets.QLabel):
             if nP:
                 self.schNC(nP)
             elif not self.curClip:
-                self.playerW.hide()
+                self.closeMedia()
         else: # No clip in this track.
-            self.playerW.hide()
+            self.closeMedia()
+
+    def closeMedia(self):
+        # Nothing to show: hide the window and release the decoder of the media.
+        self.curClip = None
+        self.playerW.hide()
+        if self.loadedMrl != None:
+            self.loadedMrl = None
+            self.player.setMedia(QtMultimedia.QMediaContent())
 
     def playerStateChange(self):
         if self.player.state() == QtMultimedia.QMediaPlayer.StoppedState: # and self.nextClip == None:
             self.playerW.hide()
+            # Out of the signal, and unless the next clip has been loaded meanwhile.
+            QtCore.QTimer.singleShot(0, lambda: self.player.mediaStatus() == QtMultimedia.QMediaPlayer.EndOfMedia and self.closeMedia())
 
     def playSchedClip(self):
         # trigger by timer
@@ -301,23 +565,82 @@ class Track(QtWidgets.QLabel):
     
         self.curClip = self.nextClip
         self.nextClip = None
+        self.transitionLateness.append(self.parent().getCurPos() - self.curClip.sPos)
 
         # Play immediately from start. Next Clip will be prepared in play().
         print(f'Track.{self.no}: Playing scheduled media {self.curClip.name}.')
-        self.player.setMedia(QtMultimedia.QMediaContent(QtCore.QUrl(self.curClip.mrl)))
-        self.playerW.setWindowTitle(f'Track {self.no}: {self.curClip.name}')
+        if not self.loadClip(self.curClip):
+            self.player.setPosition(self.curClip.mediaPos(self.parent().getCurPos()))
         self.playerW.show()
+        self.applyRate()
         self.player.play()
         nC = self.getClipsByPos(self.curClip.sPos)[1]
         if nC:
             print(f'Track.{self.no}: Got next clip {nC.name}, schedule it.')
             self.schNC(nC)
         
+    def scrubTo(self, tPos):
+        # Show the frame at the given position of the tracks while scrubbing.
+        # Only one seek is in flight, a newer target replaces the queued one and stale targets are dropped.
+        if self.worker:
+            return
+        if self.seekInFlight and time.time_ns() - self.seekInFlight[1] < Track.SEEK_TIMEOUT_NS:
+            self.seekQueued = tPos
+            return
+        self.seekQueued = None
+        clip = self.getClipsByPos(tPos)[0]
+        if clip == None:
+            self.seekInFlight = None
+            self.closeMedia()
+            return
+        if clip != self.curClip or self.loadedMrl != clip.playMrl():
+            # Switch clip, the media is opened once until the scrub leaves it.
+            self.curClip = clip
+            self.loadClip(clip)
+            self.playerW.show()
+            self.player.pause()
+        self.seekInFlight = (tPos, time.time_ns())
+        self.player.setPosition(clip.mediaPos(tPos))
+
+    def trickStep(self):
+        # Show the keyframe at the current position of the tracks, a seek is only issued for a new keyframe
+        # and when the previous one has landed, so decoding stays bounded at any speed.
+        if self.seekInFlight and time.time_ns() - self.seekInFlight[1] < Track.SEEK_TIMEOUT_NS:
+            return
+        tPos = self.parent().getCurPos()
+        clip = self.getClipsByPos(tPos)[0]
+        if clip == None:
+            self.closeMedia()
+            return
+        if clip != self.curClip or self.loadedMrl != clip.playMrl():
+            self.curClip = clip
+            self.loadClip(clip)
+            self.playerW.show()
+            self.player.pause()
+            self.trickShown = None
+        target = keyframes.keyframe_at(clip.playMrl(), clip.mediaPos(tPos))
+        if target != self.trickShown:
+            self.trickShown = target
+            self.seekInFlight = (tPos, time.time_ns())
+            self.player.setPosition(target)
+
+    def seekLanded(self, pos):
+        # Player position changed, issue the latest scrub target if there's one waiting.
+        if self.seekInFlight:
+            self.seekInFlight = None
+            if self.seekQueued != None:
+                self.scrubTo(self.seekQueued)
+
     def pause(self):
+        if self.worker:
+            return
         if self.player.pause: self.player.pause()
         self.curClipPausePos = self.parent().getCurPos()
         # Clear the timer.
         self.timer.stop()
+        self.skewTimer.stop()
+        self.trickTimer.stop()
+        self.player.setMuted(False)
 
     
     def setMarker(self, newMarker = True):
@@ -328,11 +651,15 @@ class Track(QtWidgets.QLabel):
         else:
             trks.marker = 0
     
-    def syncClipToMarker(self):
+    def syncClipToMarker(self, clpPos=None):
+        # Align the current position of the clip (in the player, or as given by the worker) with the marker.
         trks = self.parent()
 
-        clpPos = self.player.position()
-        oldPos = self.curClip.sPos + clpPos
+        if clpPos == None: clpPos = self.player.position()
+        # Align with the frame being displayed.
+        index = self.curClip.keyframeIndex()
+        if index: clpPos = index.frameAt(clpPos)
+        oldPos = self.curClip.tracksPos(clpPos)
         shiftMS = trks.marker - oldPos
         self.curClip.adjustPos(shiftMS)
         print(f'Align {oldPos} of {self.curClip.name} with marker at {trks.marker}')
@@ -351,24 +678,69 @@ class Track(QtWidgets.QLabel):
             clip = Clip(self, filename, sPos=self.ePos + 1) # Added 1ms to avoid timer overlapping.
             durationInMs = clip.duration
             if durationInMs > 0 :
-                # Create a new Clip (button) at the end of track (self.ePos).
-                self.appendClip(clip)
+                # Place the new Clip (button) by its time code, or at the end of track (self.ePos).
+                self.placeClip(clip)
 
         # Need to update tracks first for updating total duration used in calculate the width of clips!
         self.trackUpdated.emit()
         # Update btns in all tracks in event dealing in Tracks, not here!
 
+    def workerMessage(self, msg):
+        # Requests from the PlayerWidget of the worker.
+        if msg[0] == 'marker':
+            self.parent().marker = msg[1]
+        elif msg[0] == 'clearMarker':
+            self.parent().marker = 0
+        elif msg[0] == 'sync' and msg[1] < len(self.clips):
+            self.curClip = self.clips[msg[1]]
+            self.syncClipToMarker(msg[2])
+        elif msg[0] == 'volume':
+            self.workerVolume = msg[1]
+        elif msg[0] == 'position':
+            self.workerState = msg[1:]
+        elif msg[0] == 'shift' and msg[1] < len(self.clips):
+            self.clips[msg[1]].adjustPos(msg[2])
+            self.trackUpdated.emit()
+
+    def volume(self):
+        return self.workerVolume if self.worker else self.player.volume()
+
+    def setVolume(self, volume):
+        if self.worker:
+            self.workerVolume = volume
+            self.worker.send('volume', volume)
+        else:
+            self.player.setVolume(volume)
+
     def closeTrack(self):
-        self.playerW.close()
+        if self.worker:
+            self.worker.close()
+        else:
+            self.playerW.close()
 
 
 class Tracks(QtWidgets.QWidget):
-    def __init__(self, parent=None):
+
+    # Minimal interval in ms between seeks issued while scrubbing.
+    SCRUB_INTERVAL = 40
+
+    # Playback speeds of the speed dial, above RATE_SPEED_MAX is trick play.
+    SPEEDS = (1, 2, 4, 8, 16)
+
+    def __init__(self, parent=None, processPerTrack=False):
         super().__init__(parent)
 
         self.mainWindow = parent
         self.tracks = []
 
+        # Play each track in its own process, following the master clock in shared memory.
+        self.processPerTrack = processPerTrack
+        if processPerTrack:
+            self.clock = MasterClock()
+            self.workerTimer = QtCore.QTimer(self)
+            self.workerTimer.timeout.connect(self.pollWorkers)
+            self.workerTimer.start(50)
+
         # Overall playing info
         self.totalDuration = 0
 
@@ -377,8 +749,27 @@ class Tracks(QtWidgets.QWidget):
         # Marker position in ms used to sync tracks.
         self.marker = 0
 
+        # The time (from the time codes of clips) at position 0 of the tracks, set by the first clip placed by time code.
+        self.timeOrigin = None
+        # The kind of the time origin, only the clips with time codes of this kind are placed by them.
+        self.timeOriginKind = None
+
+        # Playback speed, the position of the tracks advances pbSpeedF ms per ms.
         self.pbSpeedF = 1
 
+        # Proxies of the clips, played instead of the originals when useProxies.
+        self.proxies = ProxyManager(self)
+        self.proxies.proxyChanged.connect(self.proxyChanged)
+        self.useProxies = False
+
+        # Filmstrips of the clips on the timeline.
+        self.thumbnails = ThumbnailCache(self)
+        self.thumbnails.thumbnailsReady.connect(self.thumbnailsReady)
+
+        # Audio waveforms of the clips.
+        self.waveforms = WaveformCache(self)
+        self.waveforms.waveformReady.connect(self.thumbnailsReady)
+
         #nano seconds for play position, relay on the system clock.
         # Play started postion in ms
         self.resumeFrom = 0
@@ -389,8 +780,17 @@ class Tracks(QtWidgets.QWidget):
         self.tracksBox = QtWidgets.QVBoxLayout()
         self.tracksBox.setSpacing(0)
 
+        # The slider works in ms of the tracks.
         self.positionSlider = QtWidgets.QSlider(QtCore.Qt.Horizontal, self)
 
+        # Coalescing timer for live scrubbing, only the latest slider target is sent to the tracks.
+        self.scrubTimer = QtCore.QTimer(self)
+        self.scrubTimer.setSingleShot(True)
+        self.scrubTimer.setInterval(Tracks.SCRUB_INTERVAL)
+        self.scrubTimer.timeout.connect(self.scrub)
+        self.scrubTarget = 0
+        self.scrubbedTo = None
+
         # self.ruler = QtWidgets.QLabel(self)
         # self.ruler.setSizePolicy(QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum))
 
@@ -406,6 +806,7 @@ class Tracks(QtWidgets.QWidget):
         self.addTrack()
 
         self.positionSlider.sliderPressed.connect(self.startSlide)
+        self.positionSlider.sliderMoved.connect(self.slideMoved)
         self.positionSlider.sliderReleased.connect(self.slided)
 
     def getTracksList(self):
@@ -413,6 +814,8 @@ class Tracks(QtWidgets.QWidget):
         for t in self.tracks:
             track = {}
             track['Number'] = t.no
+            track['Volume'] = t.volume()
+            track['ClockOffset'] = t.clockOffset
             track['Clips'] = []
             for c in t.clips:
                 clip = {}
@@ -421,6 +824,7 @@ class Tracks(QtWidgets.QWidget):
                 clip['startPosition'] = c.sPos
                 clip['duration'] = c.duration
                 clip['type'] = c.mediatype
+                clip['skew'] = c.skew
                 track['Clips'].append(clip)
             ts.append(track)
         return ts
@@ -433,7 +837,7 @@ class Tracks(QtWidgets.QWidget):
     def getCurPos(self):
         # return cur position in ms.
         if self.isPlaying:
-            return self.resumeFrom + int((time.time_ns()-self.resumeMomentNS)/1000000)
+            return self.resumeFrom + int((time.time_ns()-self.resumeMomentNS)/1000000 * self.pbSpeedF)
         else:
             return self.resumeFrom
 
@@ -444,6 +848,7 @@ class Tracks(QtWidgets.QWidget):
             t.playFrom(self.resumeFrom)
         self.isPlaying = True
         self.resumeMomentNS = time.time_ns()
+        self.publishClock()
         self.updateWidgets()
     
     def pausePlay(self):
@@ -452,10 +857,66 @@ class Tracks(QtWidgets.QWidget):
         for t in self.tracks:
             t.pause()
         self.isPlaying = False
+        self.publishClock()
         self.updateWidgets()
         print(f'Paused at {self.resumeFrom}.')
 
 
+    def setSpeed(self, speed):
+        # The clock is rebased at the current position, and the playing tracks restart at the new speed.
+        if speed == self.pbSpeedF:
+            return
+        if self.isPlaying:
+            self.pausePlay()
+            self.pbSpeedF = speed
+            self.resumePlay()
+        else:
+            self.pbSpeedF = speed
+            self.publishClock()
+        mode = "keyframes only" if self.trickPlay() else "playback rate"
+        self.mainWindow.statusBar().showMessage(f"Playing at {speed}x ({mode}).")
+
+    def trickPlay(self):
+        return self.pbSpeedF > RATE_SPEED_MAX
+
+    def clipAdded(self, track, clip):
+        # A clip added to a track while the tracks may be playing, update only what's needed.
+        if clip.ePos > self.totalDuration:
+            self.updateWidgets()
+        else:
+            track.placeClipBtn(clip)
+            if track.worker: track.worker.sendClips(track)
+        # In trick play the steps pick the new clip up by themselves.
+        if self.isPlaying and not track.worker and not self.trickPlay():
+            pos = self.getCurPos()
+            if clip.sPos <= pos < clip.ePos and track.curClip == None:
+                track.playFrom(pos)
+            elif clip.sPos > pos and (track.nextClip == None or clip.sPos < track.nextClip.sPos):
+                track.schNC(clip)
+
+    def timecodePos(self, clip, track):
+        # Position of the clip in the tracks from its time code, None if unknown or not of the kind of the origin.
+        if clip.startTime == None:
+            return None
+        t = clip.startTime + track.clockOffset
+        if self.timeOrigin == None:
+            # The first clip with a time code stays where it's dropped.
+            self.timeOrigin = t - (track.ePos + 1)
+            self.timeOriginKind = clip.startKind
+        if clip.startKind != self.timeOriginKind:
+            return None
+        return t - self.timeOrigin
+
+    def publishClock(self):
+        if self.processPerTrack:
+            self.clock.publish(self.isPlaying, self.resumeFrom, self.resumeMomentNS, self.pbSpeedF)
+
+    def pollWorkers(self):
+        for t in self.tracks:
+            if t.worker:
+                for msg in t.worker.messages():
+                    t.workerMessage(msg)
+
     def addTrack(self, t = None):
         # Add tracks with a dictionary (from Yaml), or an empty track.
         if (t == None or t == False): # add an empty track, when tiggered by the button, it hase the clicked = False parameter.
@@ -464,6 +925,8 @@ class Tracks(QtWidgets.QWidget):
         else:
             trackNo = t['Number']
             track = Track(self, trackNo)
+            track.setVolume(t.get('Volume', 100))
+            track.clockOffset = t.get('ClockOffset', 0)
             track.addClips(t['Clips'])
 
         # The costomized signal
@@ -475,6 +938,30 @@ class Tracks(QtWidgets.QWidget):
         track.show()
         self.mainWindow.statusBar().showMessage(f"Added Track {trackNo}.")
 
+    def setUseProxies(self, use):
+        # Switch between proxies and original media for this session, the playing tracks reload at once.
+        self.useProxies = use
+        if use: self.requestProxies()
+        if self.isPlaying:
+            self.pausePlay()
+            self.resumePlay()
+        else:
+            self.updateWidgets()
+
+    def requestProxies(self):
+        for t in self.tracks:
+            for c in t.clips:
+                self.proxies.request(c.mrl)
+
+    def proxyChanged(self, mrl, status):
+        self.mainWindow.statusBar().showMessage(f"{os.path.basename(unquote(mrl))}: {ProxyManager.STATUS_TEXT[status]}.")
+
+    def thumbnailsReady(self, mrl):
+        # Repaint the clips of the media with new thumbnails or waveform.
+        for t in self.tracks:
+            for c in t.clips:
+                if c.mrl == mrl: c.update()
+
     def updateWidgets(self):
         # print(self.tracks[0].width())
         # if self.isPlaying: self.pausePlay()
@@ -483,14 +970,18 @@ class Tracks(QtWidgets.QWidget):
         self.mainWindow.progressClock.setText(str(datetime.timedelta(seconds=self.getCurPos()/1000)) + "/" + str(datetime.timedelta(seconds=totalDurS)))
         
         if self.totalDuration > 0:
-            self.positionSlider.setRange(0, totalDurS)
-            self.positionSlider.setSingleStep(5)
+            self.positionSlider.setRange(0, self.totalDuration)
+            self.positionSlider.setSingleStep(5000)
+            self.positionSlider.setPageStep(60000)
             self.positionSlider.setDisabled(False)
         else:
             self.positionSlider.setDisabled(True)
 
+        if self.useProxies: self.requestProxies()
+
         for t in self.tracks:
             t.popClipBtn()
+            if t.worker: t.worker.sendClips(t)
 
         # self.drawRuler()
     
@@ -516,9 +1007,28 @@ class Tracks(QtWidgets.QWidget):
     def startSlide(self):
         print("Slide started.")
         self.pausePlay()
+        self.scrubbedTo = None
+
+    def slideMoved(self, value):
+        # Seek at once on the leading edge, then at most every SCRUB_INTERVAL ms.
+        self.scrubTarget = value
+        if not self.scrubTimer.isActive():
+            self.scrub()
+            self.scrubTimer.start()
+
+    def scrub(self):
+        if self.scrubTarget == self.scrubbedTo:
+            return
+        self.scrubbedTo = self.scrubTarget
+        self.resumeFrom = self.scrubTarget
+        self.publishClock()
+        for t in self.tracks:
+            t.scrubTo(self.scrubTarget)
+        self.mainWindow.progressClock.setText(str(datetime.timedelta(seconds=self.scrubTarget/1000)) + "/" + str(datetime.timedelta(seconds=int(self.totalDuration/1000))))
 
     def slided(self):
-        self.resumeFrom = self.positionSlider.value()*1000
+        self.scrubTimer.stop()
+        self.resumeFrom = self.positionSlider.value()
         print(f"Slided to {self.resumeFrom}.")
         self.resumePlay()
         
@@ -529,4 +1039,7 @@ class Tracks(QtWidgets.QWidget):
         self.tracks = []
         self.resumeFrom = 0
         self.totalDuration = 0
+        self.timeOrigin = None
+        self.timeOriginKind = None
         self.positionSlider.setValue(0)
+        self.publishClock()
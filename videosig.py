@@ -0,0 +1,104 @@
+'''
+ Video based alignment, for clips without usable audio.
+
+ Frames are decoded at low resolution and frame rate by a piped ffmpeg and
+ reduced to a compact per-frame signature: global luma, motion energy and
+ scene-cut events. Signatures are cached per clip in the media cache, and
+ matched between clips with GCC-PHAT over the signature sequences.
+'''
+
+import os, subprocess
+
+import numpy as np
+
+import mediacache
+from xcorr import gcc_phat
+
+SIG_FPS = 10
+SIG_WIDTH = 64
+SIG_HEIGHT = 36
+# Frames read from ffmpeg at a time.
+SIG_CHUNK_FRAMES = 512
+# Motion energy this many MADs above the median is a scene cut.
+CUT_THRESHOLD = 6.0
+# Signatures shorter than this (2 s) can't be matched reliably.
+MIN_SIG_FRAMES = 2 * SIG_FPS
+
+LUMA = 0
+MOTION = 1
+CUT = 2
+
+_signatures = {}
+
+
+def extract_signature(filepath):
+    # Return an (n, 3) float32 array of luma, motion energy and cut (0/1) per frame at SIG_FPS.
+    # Raise ValueError if ffmpeg fails.
+    frameSize = SIG_WIDTH * SIG_HEIGHT
+    proc = mediacache.popen(["ffmpeg", "-v", "error", "-i", filepath, "-an", "-vf", f"fps={SIG_FPS},scale={SIG_WIDTH}:{SIG_HEIGHT},format=gray",
+                             "-f", "rawvideo", "-"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    lumas = []
+    motions = []
+    prev = None
+    while True:
+        buf = proc.stdout.read(frameSize * SIG_CHUNK_FRAMES)
+        if len(buf) < frameSize:
+            break
+        frames = np.frombuffer(buf[:len(buf) // frameSize * frameSize], dtype=np.uint8).reshape(-1, frameSize).astype(np.float32)
+        lumas.append(frames.mean(axis=1))
+        # Difference to the previous frame, across the chunks too.
+        previous = np.vstack((frames[:1] if prev is None else prev, frames[:-1]))
+        motions.append(np.abs(frames - previous).mean(axis=1))
+        prev = frames[-1:]
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise ValueError(f"Decoding the video of {os.path.basename(filepath)} failed.")
+    if not lumas:
+        return np.zeros((0, 3), dtype=np.float32)
+    luma = np.concatenate(lumas)
+    motion = np.concatenate(motions)
+    median = np.median(motion)
+    mad = np.median(np.abs(motion - median)) + 1e-3
+    cut = (motion > median + CUT_THRESHOLD * mad).astype(np.float32)
+    return np.stack((luma, motion, cut), axis=1)
+
+
+def signature(mrl):
+    # Signature of the clip, from the memory or disk cache, or extracted.
+    # Raise ValueError if no frame can be decoded.
+    key = mediacache.source_key(mrl)
+    if key in _signatures:
+        return _signatures[key]
+    path = mediacache.cache_path('signatures', key, f'_{SIG_FPS}fps.npy')
+    sig = np.load(path) if os.path.exists(path) else None
+    if sig is None or len(sig) == 0:
+        # Empty signatures were cached by earlier versions, extract them again.
+        print(f"Extracting the video signature of {os.path.basename(mediacache.media_path(mrl))}.")
+        sig = extract_signature(mediacache.media_path(mrl))
+        if len(sig) == 0:
+            # Not cached, so it's tried again.
+            raise ValueError(f"No video frame could be decoded from {os.path.basename(mediacache.media_path(mrl))}.")
+        np.save(path, sig)
+    _signatures[key] = sig
+    return sig
+
+
+def features(sig):
+    # One matching sequence: normalized changes of luma and motion, with the cuts emphasized.
+    def z(x):
+        return (x - x.mean()) / (x.std() + 1e-6)
+    dLuma = np.diff(sig[:, LUMA], prepend=sig[:1, LUMA])
+    return z(np.abs(dLuma)) + z(sig[:, MOTION]) + 4 * sig[:, CUT]
+
+
+def match(sigS, sigR, window=None):
+    # Return (ms, peak) so that subject frame at t matches reference frame at t + ms.
+    # window is an optional (lo, hi) range in ms. Raise ValueError if a signature is too short to match.
+    if len(sigS) < MIN_SIG_FRAMES or len(sigR) < MIN_SIG_FRAMES:
+        raise ValueError(f"Video signature too short to match ({min(len(sigS), len(sigR)) / SIG_FPS:.1f}s).")
+    lo = hi = None
+    if window:
+        lo = int(window[0] * SIG_FPS / 1000)
+        hi = int(window[1] * SIG_FPS / 1000)
+    lag, peak = gcc_phat(features(sigS), features(sigR), lo, hi)
+    return int(round(lag * 1000 / SIG_FPS)), peak
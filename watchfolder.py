@@ -0,0 +1,112 @@
+'''
+ Watch-folder ingest for live sessions.
+
+ Directories are mapped to tracks; new recordings landing there are detected
+ with QFileSystemWatcher (inotify on Linux), or by polling when the watcher
+ can't be used. A file is taken as complete once its size stops changing,
+ then it's probed in background and inserted into its track, placed by its
+ time code, without rebuilding the tracks or interrupting the playing.
+'''
+
+from PyQt5 import QtCore
+import os
+
+import mediacache
+from tracks import Clip, probe
+
+WATCH_POLL_MS = 2000
+# A file is complete after its size is unchanged for this many polls.
+STABLE_CHECKS = 2
+MEDIA_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi', '.mts', '.m2ts', '.mxf', '.webm', '.mpg', '.ts')
+
+
+class WatchFolder(QtCore.QObject):
+
+    # track, path and probe() result, emitted from worker threads.
+    clipProbed = QtCore.pyqtSignal(object, str, object)
+
+    def __init__(self, tracks):
+        super().__init__(tracks)
+        self.tracks = tracks
+        # Watched directory -> Track, and the ones polled.
+        self.dirs = {}
+        self.polled = set()
+        # Path -> [size, unchanged polls] of files not complete yet, and the handled ones.
+        self.pending = {}
+        self.handled = set()
+        self.jobs = mediacache.BackgroundJobs("ingest")
+
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.scan)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(WATCH_POLL_MS)
+        self.timer.timeout.connect(self.poll)
+        self.clipProbed.connect(self.addClip)
+
+    def watch(self, directory, track):
+        # Ingest the new files of the directory to the track, the files already there are left out.
+        directory = os.path.abspath(directory)
+        self.dirs[directory] = track
+        self.handled.update(self.mediaFiles(directory))
+        if not self.watcher.addPath(directory):
+            print(f"Can't watch {directory}, polling it.")
+            self.polled.add(directory)
+        self.timer.start()
+        self.tracks.mainWindow.statusBar().showMessage(f"Watching {directory} for Track {track.no}.")
+
+    def unwatch(self, track=None):
+        # Stop watching the directories of the track, or all.
+        for d in [d for d, t in self.dirs.items() if track == None or t == track]:
+            self.watcher.removePath(d)
+            self.polled.discard(d)
+            del self.dirs[d]
+        if not self.dirs:
+            self.timer.stop()
+            self.pending.clear()
+
+    @staticmethod
+    def mediaFiles(directory):
+        try:
+            return [os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(MEDIA_EXTENSIONS)]
+        except OSError:
+            return []
+
+    def scan(self, directory):
+        # New files of the directory wait in pending until complete.
+        for path in self.mediaFiles(directory):
+            if path not in self.handled and path not in self.pending:
+                self.pending[path] = [-1, 0]
+
+    def poll(self):
+        for d in self.polled:
+            self.scan(d)
+        for path, state in list(self.pending.items()):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if size > 0 and size == state[0]:
+                state[1] += 1
+            else:
+                state[0] = size
+                state[1] = 0
+            if state[1] >= STABLE_CHECKS:
+                del self.pending[path]
+                self.handled.add(path)
+                track = self.dirs.get(os.path.dirname(path))
+                if track != None:
+                    self.jobs.submit(path, self.probe, track, path)
+
+    def probe(self, track, path):
+        self.clipProbed.emit(track, path, probe(path))
+
+    def addClip(self, track, path, info):
+        if track not in self.tracks.tracks:
+            return
+        clip = Clip(track, path, sPos=track.ePos + 1, info=info)
+        if clip.duration > 0:
+            track.placeClip(clip)
+            self.tracks.clipAdded(track, clip)
+        else:
+            clip.setParent(None)
@@ -0,0 +1,125 @@
+'''
+ Multi-resolution audio waveform overviews of the clips.
+
+ The audio is decoded once in background into the PCM store (shared with the
+ aligner), and reduced to min/max peak pyramids: levels of WAVE_BASE_SPP
+ samples per peak, each next level LEVEL_FACTOR times coarser. Pyramids are
+ stored as int8 in the media cache. Drawing picks the nearest level, so its
+ cost depends on the width drawn, not on the clip length or zoom.
+
+ NumPy is imported on first use, as tracks.py imports this at startup.
+'''
+
+from PyQt5 import QtCore
+import os
+
+import mediacache
+
+WAVE_RATE = 8000
+WAVE_BASE_SPP = 64
+LEVEL_FACTOR = 4
+# Samples processed at a time building the base level.
+CHUNK_SAMPLES = WAVE_BASE_SPP * 16384
+
+
+class Waveform:
+
+    def __init__(self, levels, rate=WAVE_RATE):
+        # levels[i] is an int8 array of (min, max) pairs, of WAVE_BASE_SPP * LEVEL_FACTOR**i samples each.
+        self.levels = levels
+        self.rate = rate
+
+    @staticmethod
+    def fromSamples(data, rate=WAVE_RATE):
+        import numpy as np
+        n = len(data) // WAVE_BASE_SPP
+        base = np.empty((n, 2), dtype=np.int8)
+        for i in range(0, n * WAVE_BASE_SPP, CHUNK_SAMPLES):
+            block = np.asarray(data[i:min(i + CHUNK_SAMPLES, n * WAVE_BASE_SPP)]).reshape(-1, WAVE_BASE_SPP)
+            # 16 bits samples down to 8 bits.
+            base[i // WAVE_BASE_SPP:i // WAVE_BASE_SPP + len(block), 0] = block.min(axis=1) >> 8
+            base[i // WAVE_BASE_SPP:i // WAVE_BASE_SPP + len(block), 1] = block.max(axis=1) >> 8
+        levels = [base]
+        while len(levels[-1]) >= LEVEL_FACTOR * 2:
+            prev = levels[-1]
+            m = len(prev) // LEVEL_FACTOR
+            groups = prev[:m * LEVEL_FACTOR].reshape(m, LEVEL_FACTOR, 2)
+            levels.append(np.stack((groups[:, :, 0].min(axis=1), groups[:, :, 1].max(axis=1)), axis=1))
+        return Waveform(levels, rate)
+
+    def save(self, path):
+        import numpy as np
+        with open(path, 'wb') as f:
+            np.savez(f, rate=self.rate, **{f'l{i}': l for i, l in enumerate(self.levels)})
+
+    @staticmethod
+    def load(path):
+        import numpy as np
+        with np.load(path) as d:
+            levels = [d[f'l{i}'] for i in range(len(d.files) - 1)]
+            return Waveform(levels, int(d['rate']))
+
+    def peaks(self, startMs, endMs, width):
+        # Return (mins, maxs) arrays of width pixels for the time range, from the nearest finer level.
+        import numpy as np
+        spp = (endMs - startMs) * self.rate / 1000 / max(width, 1)
+        level = 0
+        while level + 1 < len(self.levels) and WAVE_BASE_SPP * LEVEL_FACTOR ** (level + 1) <= spp:
+            level += 1
+        data = self.levels[level]
+        levelSpp = WAVE_BASE_SPP * LEVEL_FACTOR ** level
+        first = int(startMs * self.rate / 1000 / levelSpp)
+        last = min(int(np.ceil(endMs * self.rate / 1000 / levelSpp)), len(data))
+        if last <= first:
+            return np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8)
+        edges = np.linspace(first, last, width + 1).astype(np.int64)
+        edges = np.minimum(edges[:-1], last - 1)
+        return np.minimum.reduceat(data[first:last, 0], edges - first), np.maximum.reduceat(data[first:last, 1], edges - first)
+
+
+def build_waveform(mrl, path):
+    import pcmstore
+    data, rate = pcmstore.audio(mrl, WAVE_RATE)
+    waveform = Waveform.fromSamples(data, rate)
+    waveform.save(path)
+    return waveform
+
+
+class WaveformCache(QtCore.QObject):
+
+    # mrl of the clip with a new waveform, emitted from worker threads.
+    waveformReady = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = mediacache.BackgroundJobs("waveforms")
+        self.waveforms = {}
+        self.failed = set()
+
+    def get(self, mrl):
+        # The Waveform of the media, None if not available (then built in background).
+        if mrl in self.waveforms:
+            return self.waveforms[mrl]
+        if mrl in self.failed:
+            return None
+        try:
+            path = mediacache.cache_path('waveforms', mediacache.source_key(mrl), '.npz')
+        except OSError:
+            self.failed.add(mrl)
+            return None
+        if os.path.exists(path):
+            try:
+                self.waveforms[mrl] = Waveform.load(path)
+                return self.waveforms[mrl]
+            except (OSError, ValueError, KeyError):
+                pass
+        self.jobs.submit(mrl, self.build, mrl, path)
+        return None
+
+    def build(self, mrl, path):
+        try:
+            self.waveforms[mrl] = build_waveform(mrl, path)
+        except Exception:
+            self.failed.add(mrl)
+            raise
+        self.waveformReady.emit(mrl)
@@ -0,0 +1,107 @@
+'''
+ Coarse-to-fine cross-correlation aligner.
+
+ The offset is first found over the whole clips with generalized
+ cross-correlation with phase transform (GCC-PHAT) of heavily downsampled
+ amplitude envelopes, then refined at full sample rate in a small window
+ around it. Compute and memory are bounded by the envelope and window sizes,
+ and the result is sample accurate.
+'''
+
+import numpy as np
+
+# Sample rate the audio is extracted with, both clips must share it.
+AUDIO_RATE = 44100
+# Sample rate of the coarse envelope, which is also the coarse resolution.
+ENVELOPE_RATE = 100
+# Length of the full rate refinement window.
+REFINE_SECONDS = 10
+# Refinement searches this far around the coarse offset.
+REFINE_MARGIN_MS = 50
+# Samples processed at a time to build the envelope (works on memmaps and store views).
+CHUNK_SAMPLES = 1 << 20
+# With a search window (e.g. from time codes), this much of the subject is enough.
+WINDOWED_SECONDS = 300
+
+
+def envelope(data, rate, envRate=ENVELOPE_RATE):
+    # Mean absolute amplitude in blocks of rate/envRate samples.
+    factor = max(int(rate // envRate), 1)
+    n = len(data) // factor
+    env = np.empty(n, dtype=np.float32)
+    step = factor * max(CHUNK_SAMPLES // factor, 1)
+    for i in range(0, n * factor, step):
+        block = np.abs(np.asarray(data[i:min(i + step, n * factor)], dtype=np.float32))
+        m = len(block) // factor
+        env[i // factor:i // factor + m] = block[:m * factor].reshape(m, factor).mean(axis=1)
+    return env, factor
+
+
+def gcc_phat(sig, ref, lo=None, hi=None):
+    # Return (lag, peak) so that sig[t] matches ref[t + lag], lag in samples, searched in [lo, hi].
+    sig = np.asarray(sig, dtype=np.float32)
+    ref = np.asarray(ref, dtype=np.float32)
+    sig = sig - sig.mean()
+    ref = ref - ref.mean()
+    n = 1 << int(np.ceil(np.log2(len(sig) + len(ref))))
+    cross = np.fft.rfft(ref, n) * np.conj(np.fft.rfft(sig, n))
+    cross /= np.abs(cross) + 1e-12
+    cc = np.fft.irfft(cross, n)
+    # Reorder to lags -(len(sig)-1) .. len(ref)-1.
+    cc = np.concatenate((cc[n - len(sig) + 1:], cc[:len(ref)]))
+    first = -(len(sig) - 1)
+    lo = first if lo == None else max(lo, first)
+    hi = len(ref) - 1 if hi == None else min(hi, len(ref) - 1)
+    if lo > hi:
+        return 0, 0.0
+    window = cc[lo - first:hi - first + 1]
+    i = int(np.argmax(window))
+    return lo + i, float(window[i])
+
+
+def find_offset(subject, reference, rate, lo=None, hi=None):
+    # Return (lag, peak) in samples so that subject[t] matches reference[t + lag].
+    # lo and hi optionally bound the search (in samples).
+    envS, factor = envelope(subject, rate)
+    envR, factor = envelope(reference, rate)
+    coarse, peak = gcc_phat(np.diff(envS), np.diff(envR),
+                            None if lo == None else lo // factor - 1,
+                            None if hi == None else hi // factor + 1)
+    lag = coarse * factor
+
+    # Refine around the coarse offset with the middle of the overlap at full rate.
+    margin = int(rate * REFINE_MARGIN_MS / 1000) + factor
+    overlapStart = max(0, -lag)
+    overlapEnd = min(len(subject), len(reference) - lag)
+    segLen = min(int(rate * REFINE_SECONDS), overlapEnd - overlapStart)
+    if segLen <= margin:
+        return lag, peak
+    a = overlapStart + (overlapEnd - overlapStart - segLen) // 2
+    refStart = max(0, a + lag - margin)
+    refEnd = min(len(reference), a + lag + segLen + margin)
+    local, _ = gcc_phat(subject[a:a + segLen], reference[refStart:refEnd],
+                        a + lag - margin - refStart, a + lag + margin - refStart)
+    return local + refStart - a, peak
+
+
+def find_offset_ms(subject, reference, rate, window=None):
+    # Offset in ms (float) of the reference against the subject, like find_delay() of the landmarks.
+    # window is an optional (lo, hi) search range in ms.
+    if not window:
+        lag, peak = find_offset(subject, reference, rate)
+        return lag * 1000 / rate, peak
+    lo = int(window[0] * rate / 1000)
+    hi = int(window[1] * rate / 1000)
+    # Only the part of the subject that can overlap the reference within the window, and not more than needed.
+    sA = max(0, -hi)
+    sB = min(len(subject), len(reference) - lo)
+    limit = int(rate * WINDOWED_SECONDS)
+    if sB - sA > limit:
+        sA = (sA + sB - limit) // 2
+        sB = sA + limit
+    if sB <= sA:
+        return (window[0] + window[1]) / 2, 0.0
+    rA = max(0, sA + lo)
+    rB = min(len(reference), sB + hi)
+    lag, peak = find_offset(subject[sA:sB], reference[rA:rB], rate, lo + sA - rA, hi + sA - rA)
+    return (lag + rA - sA) * 1000 / rate, peak